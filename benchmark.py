@@ -0,0 +1,325 @@
+"""
+Load replay benchmark for the Flask API.
+
+Replays a synthetic or recorded workload against create_app() and reports per endpoint latency percentiles,
+requests per second, DB queries and commits per request and the command cache hit ratio.
+By default the command executor is mocked, so the benchmark runs on machines without docker.
+
+A recorded workload is a file with one JSON object per line:
+    {"method": "POST", "path": "/command/run", "json": {"command": "ls", "challenge": "01_list_all_files"}, "headers": {}}
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import typing
+from collections import defaultdict
+from uuid import uuid4
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+
+class Stats(object):
+    """ Thread safe collection of per endpoint measurements """
+
+    def __init__(self):
+        self.latencies: typing.Dict[str, typing.List[float]] = defaultdict(list)
+        self.queries: typing.Dict[str, typing.List[int]] = defaultdict(list)
+        self.commits: typing.Dict[str, typing.List[int]] = defaultdict(list)
+        self.status_codes: typing.Dict[str, typing.Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.cache_hits: int = 0
+        self.cache_misses: int = 0
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, latency: float, queries: int, commits: int, status_code: int, body: typing.Optional[dict]) -> None:
+        with self._lock:
+            self.latencies[endpoint].append(latency)
+            self.queries[endpoint].append(queries)
+            self.commits[endpoint].append(commits)
+            self.status_codes[endpoint][status_code] += 1
+            if endpoint == "/command/run" and isinstance(body, dict) and 'cached' in body:
+                if body['cached']:
+                    self.cache_hits += 1
+                else:
+                    self.cache_misses += 1
+
+
+class QueryCounter(object):
+    """ Counts the SQL statements and commits issued by the current thread """
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self._local = threading.local()
+        event.listen(engine, "before_cursor_execute", self._count)
+        event.listen(engine, "commit", self._count_commit)
+
+    def _count(self, *args, **kwargs):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def _count_commit(self, *args, **kwargs):
+        self._local.commits = getattr(self._local, 'commits', 0) + 1
+
+    def reset(self) -> None:
+        self._local.count = 0
+        self._local.commits = 0
+
+    @property
+    def count(self) -> int:
+        return getattr(self._local, 'count', 0)
+
+    @property
+    def commits(self) -> int:
+        return getattr(self._local, 'commits', 0)
+
+
+def close_buffers(app) -> bool:
+    """ Store the pending writes of the write-behind buffers and close the database connections """
+    from server.cache_eviction import cache_sweeper
+    from server.commandlog import command_log
+    from server.extensions import db
+    from server.identifiers import identifier_tracker
+
+    stored = True
+    for buffer in (identifier_tracker.buffer, command_log.buffer, cache_sweeper.hits):
+        if not buffer.close():
+            print(f"Could not store the pending writes of {buffer.name}")
+            stored = False
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    return stored
+
+
+def percentile(values: typing.List[float], p: float) -> float:
+    ordered = sorted(values)
+    index = min(int(round(p / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def endpoint_of(path: str) -> str:
+    """ Group paths with identifiers, e.g. /user/<uuid>/state """
+    parts = path.split("/")
+    if len(parts) > 2 and parts[1] == "user":
+        parts[2] = "<uuid>"
+    if len(parts) > 3 and parts[1] == "command" and parts[2] == "result":
+        parts[3] = "<id>"
+    return "/".join(parts)
+
+
+def mock_executor(latency: float):
+    """ Replace the docker based executor with one that answers after latency seconds """
+    from server.extensions import c
+
+    def run_command_parsed(command, challenge, version=None):
+        time.sleep(latency)
+        return dict(success=random.random() < 0.5, output=" ".join(command) + "\n")
+
+    c.run_command_parsed = run_command_parsed
+
+
+def database_app():
+    """ An app with nothing but the database. Used to seed the tables before create_app() loads the registries """
+    from flask import Flask
+    from server.config import config
+    from server.extensions import db
+
+    app = Flask(__name__)
+    app.config.from_object(config)
+    db.init_app(app)
+    return app
+
+
+def seed(app) -> None:
+    """ Load challenges and badges """
+    from server.extensions import db
+    from server.models import Badge, Challenge
+
+    with app.app_context():
+        db.create_all()
+        with open(os.path.join(basedir, "executor/docker_image/ro_volume/challenges.json"), "r") as challenge_fd:
+            Challenge.bulk_create(
+                dict(
+                    identifier=challenge['identifier'],
+                    name=challenge['name'],
+                    description=challenge['description'],
+                    help=challenge.get('help', None),
+                    external_link=challenge.get('external_link', None),
+                )
+                for challenge in json.loads(challenge_fd.read()).values()
+            )
+        with open(os.path.join(basedir, "data/badges.json"), "r") as badge_fd:
+            Badge.bulk_create(
+                dict(
+                    name=badge['name'],
+                    src_filename=badge['src_filename'],
+                    description=badge['description'],
+                    condition=badge.get('condition')
+                )
+                for badge in json.loads(badge_fd.read()).values()
+            )
+
+
+def create_users(app, users: int) -> typing.List[str]:
+    """ Returns the UUIDs of the new users """
+    from server.crud import unit_of_work
+    from server.models import User
+
+    with app.app_context():
+        with unit_of_work():
+            return [User.create_user().uuid for _ in range(users)]
+
+
+def synthetic_workload(args, challenges: typing.Dict[str, dict], uuids: typing.List[str]) -> typing.Iterator[dict]:
+    """
+    Endless stream of requests. Command runs are either one of a few popular commands (cache hits after their first run)
+    or a unique command (always a cache miss), according to --hit-ratio.
+    """
+    challenge_ids = list(challenges.keys())
+    popular = [(challenges[challenge_id]['solution'], challenge_id) for challenge_id in challenge_ids]
+    weights = dict(run=args.run_weight, state=args.state_weight, challenges=args.list_weight, badges=args.list_weight)
+    kinds, kind_weights = zip(*weights.items())
+    while True:
+        uuid = random.choice(uuids)
+        headers = {'X-UUID': uuid, 'X-Real-Ip': f"10.0.{uuids.index(uuid) // 250}.{uuids.index(uuid) % 250}"}
+        kind = random.choices(kinds, kind_weights)[0]
+        if kind == "run":
+            if random.random() < args.hit_ratio:
+                command, challenge_id = random.choice(popular)
+            else:
+                command, challenge_id = f"echo {uuid4()}", random.choice(challenge_ids)
+            yield dict(method="POST", path="/command/run", json=dict(command=command, challenge=challenge_id), headers=headers)
+        elif kind == "state":
+            yield dict(method="GET", path=f"/user/{uuid}/state", headers=headers)
+        elif kind == "challenges":
+            yield dict(method="GET", path="/challenge/list", headers=headers)
+        else:
+            yield dict(method="GET", path="/badges/list", headers=headers)
+
+
+def recorded_workload(filename: str) -> typing.Iterator[dict]:
+    with open(filename, "r") as workload_fd:
+        requests = [json.loads(line) for line in workload_fd if line.strip()]
+    while True:
+        yield from requests
+
+
+def replay(app, workload: typing.Iterator[dict], total: int, concurrency: int, counter: QueryCounter, stats: Stats) -> float:
+    """ Send total requests from concurrency threads. Returns the wall time """
+    lock = threading.Lock()
+    remaining = [total]
+
+    def next_request() -> typing.Optional[dict]:
+        with lock:
+            if remaining[0] <= 0:
+                return None
+            remaining[0] -= 1
+            return next(workload)
+
+    def worker():
+        client = app.test_client()
+        request = next_request()
+        while request is not None:
+            counter.reset()
+            start = time.perf_counter()
+            response = client.open(
+                request['path'],
+                method=request.get('method', 'GET'),
+                json=request.get('json'),
+                headers=request.get('headers', {})
+            )
+            latency = time.perf_counter() - start
+            stats.record(endpoint_of(request['path']), latency, counter.count, counter.commits, response.status_code, response.get_json(silent=True))
+            request = next_request()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def print_report(stats: Stats, wall_time: float) -> None:
+    total = sum(len(latencies) for latencies in stats.latencies.values())
+    print(f"{'endpoint':<24} {'count':>7} {'req/s':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'queries':>8} {'commits':>8}  status codes")
+    for endpoint, latencies in sorted(stats.latencies.items()):
+        queries = stats.queries[endpoint]
+        commits = stats.commits[endpoint]
+        codes = ", ".join(f"{code}: {count}" for code, count in sorted(stats.status_codes[endpoint].items()))
+        print(f"{endpoint:<24} {len(latencies):>7} {len(latencies) / wall_time:>8.1f} "
+              f"{percentile(latencies, 50) * 1000:>9.2f} {percentile(latencies, 95) * 1000:>9.2f} {percentile(latencies, 99) * 1000:>9.2f} "
+              f"{sum(queries) / len(queries):>8.1f} {sum(commits) / len(commits):>8.1f}  {codes}")
+    lookups = stats.cache_hits + stats.cache_misses
+    hit_ratio = stats.cache_hits / lookups * 100 if lookups else 0
+    print(f"\n{total} requests in {wall_time:.2f}s ({total / wall_time:.1f} req/s). Command cache hit ratio: {hit_ratio:.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--requests", type=int, default=2000, help="Total number of requests")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Number of concurrent clients")
+    parser.add_argument("-u", "--users", type=int, default=50, help="Number of synthetic users")
+    parser.add_argument("--hit-ratio", type=float, default=0.8, help="Share of command runs using popular (cacheable) commands")
+    parser.add_argument("--run-weight", type=float, default=5, help="Relative weight of /command/run")
+    parser.add_argument("--state-weight", type=float, default=2, help="Relative weight of /user/<uuid>/state")
+    parser.add_argument("--list-weight", type=float, default=1, help="Relative weight of each list endpoint")
+    parser.add_argument("--replay", help="File with a recorded workload (one JSON request per line)")
+    parser.add_argument("--docker", action="store_true", help="Execute commands with docker instead of the mocked executor")
+    parser.add_argument("--mock-latency", type=float, default=50, help="Latency of the mocked executor in ms")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed")
+    parser.add_argument("--max-run-commits", type=float, default=None,
+                        help="Fail if /command/run commits more often than this per request on average")
+    parser.add_argument("--max-queries", action="append", default=[], metavar="ENDPOINT=N",
+                        help="Fail if the endpoint issues more than N queries per request on average. May be repeated")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    # the database is configured when the config module is imported
+    db_dir = tempfile.TemporaryDirectory()
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(db_dir.name, "benchmark.db")
+
+    from server.app import create_app
+    from server.extensions import db
+
+    seed(database_app())
+    app = create_app()
+    if not args.docker:
+        mock_executor(args.mock_latency / 1000)
+    uuids = create_users(app, args.users)
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+
+    if args.replay:
+        workload = recorded_workload(args.replay)
+    else:
+        with open(os.path.join(basedir, "executor/docker_image/ro_volume/challenges.json"), "r") as challenge_fd:
+            challenges = json.loads(challenge_fd.read())
+        workload = synthetic_workload(args, challenges, uuids)
+
+    stats = Stats()
+    wall_time = replay(app, workload, args.requests, args.concurrency, counter, stats)
+    print_report(stats, wall_time)
+    # the buffers would be flushed at exit otherwise, after the database is gone
+    failed = not close_buffers(app)
+    db_dir.cleanup()
+
+    run_commits = stats.commits.get("/command/run")
+    if args.max_run_commits is not None and run_commits and sum(run_commits) / len(run_commits) > args.max_run_commits:
+        print(f"/command/run commits {sum(run_commits) / len(run_commits):.2f} times per request (max {args.max_run_commits})")
+        failed = True
+    for budget in args.max_queries:
+        endpoint, max_queries = budget.rsplit("=", 1)
+        queries = stats.queries.get(endpoint)
+        if queries and sum(queries) / len(queries) > float(max_queries):
+            print(f"{endpoint} issues {sum(queries) / len(queries):.2f} queries per request (max {max_queries})")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Build step for the challenge definitions used by the command runner.
+
+Parsing the whole challenges.json just to pick out a single challenge gets slower with every new challenge.
+This module splits the file into one compact JSON file per challenge, so that the runner only loads what it needs.
+"""
+import json
+import os
+import typing
+
+from executor.docker_config import volume_dir
+
+CHALLENGE_FILE = os.path.join(volume_dir, "challenges.json")
+COMPILED_DIR = os.path.join(volume_dir, "compiled")
+
+
+def compile_challenges(challenge_file: str = CHALLENGE_FILE, output_dir: str = COMPILED_DIR) -> typing.List[str]:
+    """ Write every challenge definition of challenge_file into output_dir/<identifier>.json. Returns the identifiers """
+    with open(challenge_file, "r") as challenge_fd:
+        definitions: dict = json.loads(challenge_fd.read())
+
+    os.makedirs(output_dir, exist_ok=True)
+    for identifier, definition in definitions.items():
+        if os.path.basename(identifier) != identifier:
+            raise ValueError(f"{identifier} is not a valid challenge identifier")
+        with open(os.path.join(output_dir, f"{identifier}.json"), "w") as compiled_fd:
+            json.dump(definition, compiled_fd, separators=(',', ':'))
+
+    # drop definitions of removed challenges
+    for filename in os.listdir(output_dir):
+        identifier, extension = os.path.splitext(filename)
+        if extension == ".json" and identifier not in definitions:
+            os.remove(os.path.join(output_dir, filename))
+
+    return list(definitions.keys())
@@ -0,0 +1,66 @@
+"""
+Client for the command runner daemon (run_cmd --serve) inside a pooled container.
+
+The daemon reads one JSON request per line from STDIN and answers with one JSON line on STDOUT.
+We talk to it through the container's attach socket. Since the container has no TTY,
+docker multiplexes STDOUT and STDERR over that socket: every frame starts with an 8 byte header (stream, 0, 0, 0, size).
+"""
+import json
+import select
+import socket
+import struct
+import time
+
+from executor.exceptions import OutputLimitExceeded
+
+STDOUT = 1
+FRAME_HEADER = struct.Struct('>BxxxL')
+
+
+class DaemonConnection(object):
+
+    def __init__(self, container):
+        self.container = container
+        self.socket = container.attach_socket(params={'stdin': 1, 'stdout': 1, 'stderr': 1, 'stream': 1})
+        # docker-py hands out a SocketIO wrapper for UNIX sockets
+        self.raw: socket.socket = getattr(self.socket, '_sock', self.socket)
+        self._stdout = b""
+
+    def close(self) -> None:
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+
+    def request(self, payload: dict, timeout: float, max_size: int = None) -> bytes:
+        """
+        Send a request and return the raw JSON response line.
+        Raises a TimeoutError if there is no complete response within timeout seconds,
+        an OutputLimitExceeded error if the response gets larger than max_size bytes
+        and a ConnectionError if the daemon went away.
+        """
+        deadline = time.monotonic() + timeout
+        self.raw.sendall(json.dumps(payload).encode('utf-8') + b"\n")
+        while b"\n" not in self._stdout:
+            stream, size = FRAME_HEADER.unpack(self._read_exactly(FRAME_HEADER.size, deadline))
+            data = self._read_exactly(size, deadline)
+            if stream == STDOUT:
+                self._stdout += data
+            if max_size and len(self._stdout) > max_size:
+                raise OutputLimitExceeded(f"Runner daemon sent more than {max_size} bytes")
+        line, self._stdout = self._stdout.split(b"\n", 1)
+        return line
+
+    def _read_exactly(self, size: int, deadline: float) -> bytes:
+        data = b""
+        while len(data) < size:
+            remaining = deadline - time.monotonic()
+            readable, _, _ = select.select([self.raw], [], [], max(remaining, 0))
+            if not readable:
+                raise TimeoutError()
+            chunk = self.raw.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Runner daemon closed the connection")
+            data += chunk
+        return data
+
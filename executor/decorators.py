@@ -1,6 +1,8 @@
 import functools
 import logging
 
+from executor.tracing import stage
+
 logger = logging.getLogger(__name__)
 
 
@@ -12,3 +14,16 @@ def log_command(docker_fn):
         return docker_fn(*args, **kwargs)
 
     return wrap_docker_function_and_log_command
+
+
+def trace_stage(name):
+    # record every call as a stage of the current request trace
+    def wrapper(func):
+        @functools.wraps(func)
+        def wrap_function_and_trace_stage(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+
+        return wrap_function_and_trace_stage
+
+    return wrapper
@@ -4,11 +4,18 @@ import os
 logger = logging.getLogger(__name__)
 
 basedir = os.path.abspath(os.path.dirname(__file__))
-volume_dir = os.path.join(basedir, "docker_image/ro_volume").replace('/mnt', '')
+volume_dir = os.path.join(basedir, "docker_image/ro_volume")
 
 logger.debug(volume_dir)
 
 
+def mount_source(host_path: str) -> str:
+    """ Host directory as the docker daemon sees it. Docker on the WSL mounts the drives at /c instead of /mnt/c """
+    if host_path.startswith('/mnt/'):
+        return host_path[len('/mnt'):]
+    return host_path
+
+
 class DockerConfig(object):
     # You are most likely not going to change these
     MEM_LIMIT = "100mb"
@@ -20,21 +27,83 @@ class DockerConfig(object):
 
     WORKING_DIR = "/challenges/"
     RO_VOLUME = "/ro_volume"
+    # Containers that run more than one command have a read-only root file system.
+    # Only these are writable. The runner restores /challenges from the copy in the image (/ro_challenges)
+    # and empties /tmp and /dev/shm between two commands
+    TMPFS = {
+        "/challenges": "size=64m",
+        "/tmp": "size=16m",
+        "/dev/shm": "size=1m",
+    }
     COMMAND_RUNNER_PATH = RO_VOLUME + "/run_cmd"
 
     # The variables below are going to change depending on your setup
     EXECUTION_TIMEOUT = os.getenv("EXECUTION_TIMEOUT", 5)
+    # Max bytes of command output. The runner kills commands that exceed it
+    OUTPUT_LIMIT = int(os.getenv("OUTPUT_LIMIT", 64 * 1024))
     DOCKER_IMAGE = os.getenv("DOCKER_IMAGE", "terminal_image")
     DOCKER_BASE_URL = os.getenv("DOCKER_BASE_URL")
 
+    # Pool of pre-started containers. A POOL_SIZE of 0 disables the pool and starts a new container for every command
+    POOL_SIZE = int(os.getenv("POOL_SIZE", 4))
+    POOL_MIN_IDLE = int(os.getenv("POOL_MIN_IDLE", 2))
+    POOL_MAX_IDLE = int(os.getenv("POOL_MAX_IDLE", 4))
+    POOL_MAX_USES = int(os.getenv("POOL_MAX_USES", 100))
+    POOL_HEALTH_INTERVAL = float(os.getenv("POOL_HEALTH_INTERVAL", 30))
+    # Pooled containers run the command runner as a daemon instead of starting it for every command
+    POOL_RUNNER_DAEMON = os.getenv("POOL_RUNNER_DAEMON", "1") == "1"
+    # Label of the pooled containers. Containers of dead processes with the same label are removed when a pool starts
+    POOL_NAME = os.getenv("POOL_NAME", "terminal")
+
     @classmethod
     def runner_arguments(cls) -> dict:
         return {
             'mem_limit': cls.MEM_LIMIT,
             'network_mode': cls.NETWORK_MODE,
             'network_disabled': cls.NETWORK_DISABLED,
-            'volumes': {volume_dir: {"bind": cls.RO_VOLUME, "mode": "ro"}},
+            'volumes': {
+                mount_source(volume_dir): {"bind": cls.RO_VOLUME, "mode": "ro"},
+            },
             'remove': cls.REMOVE,
             'stderr': cls.STDERR,
             'detach': cls.DETACH,
+            'environment': {'RUN_CMD_OUTPUT_LIMIT': str(cls.OUTPUT_LIMIT)},
+        }
+
+    @classmethod
+    def isolated_runner_arguments(cls) -> dict:
+        """ Arguments for containers that run more than one command, e.g. pooled runner daemons and batches """
+        arguments = cls.runner_arguments()
+        arguments.update(read_only=True, tmpfs=dict(cls.TMPFS))
+        return arguments
+
+    @classmethod
+    def response_limit(cls) -> int:
+        """ Max bytes read from a container. JSON escaping may blow up every byte of output to six (\\u0000) """
+        return cls.OUTPUT_LIMIT * 6 + 1024
+
+    @classmethod
+    def pool_container_arguments(cls) -> dict:
+        if cls.POOL_RUNNER_DAEMON:
+            arguments = cls.isolated_runner_arguments()
+            arguments.update(stdin_open=True, working_dir=cls.WORKING_DIR)
+            return arguments
+        return cls.runner_arguments()
+
+    @classmethod
+    def pool_command(cls) -> tuple:
+        if cls.POOL_RUNNER_DAEMON:
+            return cls.COMMAND_RUNNER_PATH, "--serve"
+        return "sleep", "infinity"
+
+    @classmethod
+    def pool_arguments(cls) -> dict:
+        return {
+            'command': cls.pool_command(),
+            'size': cls.POOL_SIZE,
+            'min_idle': cls.POOL_MIN_IDLE,
+            'max_idle': cls.POOL_MAX_IDLE,
+            'max_uses': cls.POOL_MAX_USES,
+            'health_interval': cls.POOL_HEALTH_INTERVAL,
+            'name': cls.POOL_NAME,
         }
@@ -1,3 +1,19 @@
+import typing
+
+
 class ExecutionException(Exception):
     """ Custom Exception for handling failing commands inside a docker container """
     pass
+
+
+class OutputLimitExceeded(ExecutionException):
+    """ Raised if a container produced more output than we are willing to read """
+    pass
+
+
+class UncacheableOutput(ExecutionException):
+    """ Raised with the output of a failed execution, so that the lru_cache does not remember it """
+
+    def __init__(self, output: typing.Optional[bytes]):
+        super().__init__("The command could not be executed")
+        self.output = output
@@ -0,0 +1,176 @@
+"""
+Minimal, thread safe metrics in the Prometheus text exposition format.
+
+Metrics are registered in the module level registry and rendered by the /metrics endpoint of the server.
+Values that already live somewhere else (e.g. pool or cache statistics) are exported through callbacks,
+which are evaluated every time the metrics are rendered.
+Note that every (WSGI worker) process has its own registry.
+"""
+import threading
+import time
+import typing
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = typing.Tuple[typing.Tuple[str, str], ...]
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric(object):
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, registry: "Registry" = None):
+        self.name = name
+        self.documentation = documentation
+        self._values: typing.Dict[Labels, typing.Any] = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    @staticmethod
+    def labels_key(labels: dict) -> Labels:
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def samples(self) -> typing.Iterator[typing.Tuple[str, Labels, float]]:
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name, labels, value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self.labels_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels) -> typing.Iterator[None]:
+        """ Count the code block as in progress while it runs """
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: typing.Sequence[float] = DEFAULT_BUCKETS, registry: "Registry" = None):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        super().__init__(name, documentation, registry=registry)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.labels_key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels) -> typing.Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> typing.Iterator[typing.Tuple[str, Labels, float]]:
+        with self._lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self._values.items()}
+        for labels, (counts, total) in sorted(values.items()):
+            for bound, count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket", labels + (("le", format_value(bound)),), count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, counts[-1]
+
+
+class CallbackGauge(Metric):
+    """ Gauge whose values are computed by func when the metrics are rendered. func returns {labels dict or None: value} """
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, func: typing.Callable[[], typing.Dict], registry: "Registry" = None):
+        self.func = func
+        super().__init__(name, documentation, registry=registry)
+
+    def samples(self) -> typing.Iterator[typing.Tuple[str, Labels, float]]:
+        try:
+            values = self.func() or {}
+        except Exception:
+            return
+        for labels, value in values.items():
+            yield self.name, tuple(labels or ()), value
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._metrics: typing.Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> None:
+        with self._lock:
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> typing.Optional[Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def label_items(**labels) -> Labels:
+    """ Labels for the dicts returned by CallbackGauge functions """
+    return Metric.labels_key(labels)
+
+
+REGISTRY = Registry()
+
+# Executor metrics
+CONTAINER_LATENCY = Histogram("executor_container_seconds", "Latency of docker container operations by stage")
+EXECUTION_FAILURES = Counter("executor_failures_total", "Failed command executions by reason")
+EXECUTIONS_IN_FLIGHT = Gauge("executor_in_flight", "Command executions currently running")
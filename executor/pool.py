@@ -0,0 +1,343 @@
+"""
+Pool of pre-started, idle docker containers.
+
+Creating, starting and removing a container for every submission is by far the most expensive part of a command execution.
+Instead the pool keeps a number of idle containers running in the background.
+Each submission borrows one of them, execs the command runner inside of it and gives it back afterwards.
+Containers whose state can not be trusted anymore (e.g. because a command mutated files) are recycled:
+they are removed and replaced by a fresh one in the background.
+
+Pooled containers are labelled with the name of their pool and the process that owns them.
+A process that is killed can not remove its containers, so every pool removes the containers of dead owners when it starts.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import typing
+
+from docker import DockerClient
+from docker.errors import APIError, NotFound
+from requests import HTTPError
+
+from executor.metrics import CONTAINER_LATENCY
+from executor.tracing import stage
+
+logger = logging.getLogger(__name__)
+
+IDLE_COMMAND = ("sleep", "infinity")  # keeps the container running, so commands can be exec'd
+
+# arguments of containers.run that containers.create does not accept
+RUN_ONLY_ARGUMENTS = ("stdout", "stderr", "remove", "stream")
+
+POOL_LABEL = "terminal.pool"
+# <hostname>:<pid> of the process that owns the container
+OWNER_LABEL = "terminal.pool.owner"
+
+
+def owner_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # exists, but belongs to someone else
+        return True
+    return True
+
+
+def is_orphan(labels: typing.Dict[str, str]) -> bool:
+    """ Whether the owner of a pooled container is dead. Containers owned by other hosts can not be checked """
+    host, _, pid = labels.get(OWNER_LABEL, "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    return int(pid) != os.getpid() and not is_alive(int(pid))
+
+
+def run_container(client: DockerClient, image: str, command: typing.Sequence[str], **arguments):
+    """
+    Same as client.containers.run(..., detach=True), but records the create and start latency separately.
+    A container that was created, but could not be started, is removed again.
+    """
+    create_arguments = {key: value for key, value in arguments.items() if key not in RUN_ONLY_ARGUMENTS}
+    with stage("container_create", CONTAINER_LATENCY, stage="create"):
+        container = client.containers.create(image, command, **create_arguments)
+    try:
+        with stage("container_start", CONTAINER_LATENCY, stage="start"):
+            container.start()
+    except Exception:
+        try:
+            container.remove(force=True)
+        except (NotFound, APIError, HTTPError) as error:
+            logger.warning(f"Could not remove container {container.short_id}: {error}")
+        raise
+    return container
+
+
+class PoolExhausted(Exception):
+    """ Raised if no container could be borrowed within the given timeout """
+    pass
+
+
+class PooledContainer(object):
+    """ Book keeping for a single container owned by the pool """
+
+    def __init__(self, container):
+        self.container = container
+        self.created_at: float = time.monotonic()
+        self.last_checked: float = self.created_at
+        self.uses: int = 0
+        # connection to the runner daemon, if the container runs one
+        self.connection = None
+
+    def __repr__(self):
+        return f"<PooledContainer {self.container.short_id} uses={self.uses}>"
+
+
+class ContainerPool(object):
+    """
+    Thread safe pool of running containers for a single docker image.
+
+    size:             max number of containers (idle + borrowed) the pool is going to own at once
+    min_idle:         number of idle containers the pool tries to keep ready at all times
+    max_idle:         idle containers above this threshold are removed when they are returned
+    max_uses:         containers are recycled after they served this many commands
+    health_interval:  idle containers are health checked before borrowing, if they were not checked for this many seconds
+    name:             value of the terminal.pool label. Pools of the same name remove each other's orphans
+    """
+
+    def __init__(self, client: DockerClient, image: str, run_arguments: dict, size: int = 4, min_idle: int = 2,
+                 max_idle: int = 4, max_uses: int = 1, health_interval: float = 30.0,
+                 command: typing.Tuple[str, ...] = IDLE_COMMAND, name: str = "terminal"):
+        self.client = client
+        self.image = image
+        self.name = name
+        self.run_arguments = run_arguments
+        self.command = command
+        self.size = max(size, 1)
+        self.min_idle = min(min_idle, self.size)
+        self.max_idle = max(max_idle, self.min_idle)
+        self.max_uses = max_uses
+        self.health_interval = health_interval
+
+        self._idle: typing.List[PooledContainer] = []
+        self._borrowed: typing.Set[PooledContainer] = set()
+        self._starting: int = 0
+        self._lock = threading.Condition()
+        self._closed = False
+
+        # stats
+        self._created = 0
+        self._recycled = 0
+        self._unhealthy = 0
+        self._borrows = 0
+        self._waits = 0
+        self._orphans = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.shutdown()
+
+    # Container lifecycle
+
+    @property
+    def labels(self) -> typing.Dict[str, str]:
+        return {POOL_LABEL: self.name, OWNER_LABEL: owner_id()}
+
+    def _create(self) -> typing.Optional[PooledContainer]:
+        arguments = dict(self.run_arguments, labels=dict(self.run_arguments.get('labels') or {}, **self.labels))
+        try:
+            container = run_container(self.client, self.image, self.command, **arguments)
+        except (NotFound, APIError, HTTPError) as error:
+            logger.error(f"Could not start pooled container: {error}")
+            return None
+        logger.debug(f"Started pooled container {container.short_id}")
+        return PooledContainer(container)
+
+    def _destroy(self, pooled: PooledContainer) -> None:
+        if pooled.connection is not None:
+            pooled.connection.close()
+        try:
+            with CONTAINER_LATENCY.time(stage="remove"):
+                pooled.container.remove(force=True)
+        except (NotFound, APIError, HTTPError) as error:
+            logger.warning(f"Could not remove pooled container {pooled.container.short_id}: {error}")
+
+    def _is_healthy(self, pooled: PooledContainer) -> bool:
+        """ The container must be running and its file system must not differ from the image """
+        try:
+            pooled.container.reload()
+            changes = pooled.container.diff()
+        except (NotFound, APIError, HTTPError):
+            return False
+        pooled.last_checked = time.monotonic()
+        if changes:
+            logger.warning(f"Pooled container {pooled.container.short_id} modified its image: {changes[:5]}")
+            return False
+        return pooled.container.status == "running"
+
+    def _total(self) -> int:
+        return len(self._idle) + len(self._borrowed) + self._starting
+
+    def _spawn(self) -> bool:
+        """ Create a single container and put it into the idle list. Caller must have reserved a slot in _starting """
+        pooled = self._create()
+        discard = False
+        with self._lock:
+            self._starting -= 1
+            if pooled:
+                self._created += 1
+                if self._closed:
+                    discard = True
+                else:
+                    self._idle.append(pooled)
+            self._lock.notify_all()
+        if discard:
+            self._destroy(pooled)
+        return pooled is not None
+
+    def _refill(self) -> None:
+        """ Top up the idle containers to min_idle in background threads """
+        with self._lock:
+            if self._closed:
+                return
+            missing = min(self.min_idle - len(self._idle) - self._starting, self.size - self._total())
+            self._starting += max(missing, 0)
+        for _ in range(max(missing, 0)):
+            threading.Thread(target=self._spawn, daemon=True).start()
+
+    def remove_orphans(self) -> int:
+        """ Remove the containers of this pool whose owner died without shutting its pool down, e.g. after a SIGKILL """
+        try:
+            containers = self.client.containers.list(all=True, filters={'label': f"{POOL_LABEL}={self.name}"})
+        except (APIError, HTTPError) as error:
+            logger.warning(f"Could not list the containers of pool {self.name}: {error}")
+            return 0
+        removed = 0
+        for container in containers:
+            if not is_orphan(container.labels):
+                continue
+            try:
+                container.remove(force=True)
+            except (NotFound, APIError, HTTPError) as error:
+                logger.warning(f"Could not remove orphaned container {container.short_id}: {error}")
+                continue
+            removed += 1
+        if removed:
+            logger.info(f"Removed {removed} orphaned containers of pool {self.name}")
+        with self._lock:
+            self._orphans += removed
+        return removed
+
+    def start(self) -> None:
+        """ Remove orphaned containers and pre-start min_idle containers """
+        self.remove_orphans()
+        self._refill()
+
+    # Public API
+
+    def acquire(self, timeout: float = None) -> PooledContainer:
+        """
+        Borrow a healthy, running container.
+        Blocks until a container is available or raises PoolExhausted after timeout seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            candidate = None
+            spawn = False
+            with self._lock:
+                if self._closed:
+                    raise PoolExhausted("Pool was shut down")
+                if self._idle:
+                    candidate = self._idle.pop()
+                    self._borrowed.add(candidate)
+                elif self._total() < self.size:
+                    self._starting += 1
+                    spawn = True
+                else:
+                    self._waits += 1
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise PoolExhausted(f"No container available after {timeout}s")
+                    self._lock.wait(remaining)
+                    continue
+
+            if spawn:
+                # nothing idle, but there is room for one more container
+                if not self._spawn():
+                    raise PoolExhausted("Could not start a new container")
+                continue
+
+            if time.monotonic() - candidate.last_checked > self.health_interval and not self._is_healthy(candidate):
+                logger.warning(f"Pooled container {candidate.container.short_id} is unhealthy. Recycling it.")
+                with self._lock:
+                    self._borrowed.discard(candidate)
+                    self._unhealthy += 1
+                    self._lock.notify_all()
+                self._destroy(candidate)
+                continue
+
+            with self._lock:
+                candidate.uses += 1
+                self._borrows += 1
+            self._refill()
+            return candidate
+
+    def release(self, pooled: PooledContainer, reusable: bool = False) -> None:
+        """
+        Give a borrowed container back.
+        If it is not reusable or has served max_uses commands, it is removed and replaced in the background.
+        """
+        with self._lock:
+            self._borrowed.discard(pooled)
+            keep = (
+                    reusable
+                    and not self._closed
+                    and pooled.uses < self.max_uses
+                    and len(self._idle) < self.max_idle
+            )
+            if keep:
+                self._idle.append(pooled)
+            else:
+                self._recycled += 1
+            self._lock.notify_all()
+
+        if not keep:
+            # removing a container takes a while, don't let the caller wait for it
+            threading.Thread(target=self._destroy, args=(pooled,), daemon=True).start()
+        self._refill()
+
+    def shutdown(self) -> None:
+        """ Remove all idle containers. Borrowed containers are removed when they are returned """
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._lock.notify_all()
+        for pooled in idle:
+            self._destroy(pooled)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                image=self.image,
+                size=self.size,
+                min_idle=self.min_idle,
+                max_idle=self.max_idle,
+                idle=len(self._idle),
+                borrowed=len(self._borrowed),
+                starting=self._starting,
+                created=self._created,
+                recycled=self._recycled,
+                unhealthy=self._unhealthy,
+                borrows=self._borrows,
+                waits=self._waits,
+                orphans_removed=self._orphans,
+            )
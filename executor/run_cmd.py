@@ -7,9 +7,11 @@ Note:
     Some challenges may change files, create files or delete files/folders.
     This is easy to check from inside the running container, but hard to check from outside.
 """
+import atexit
 import json
 import logging
 import os
+import threading
 import typing
 from functools import lru_cache
 from json.decoder import JSONDecodeError
@@ -19,10 +21,43 @@ from docker import DockerClient
 
 from executor.decorators import log_command
 from executor.docker_config import DockerConfig
-from executor.timeout import ContainerTimeout
+from executor.exceptions import UncacheableOutput
+from executor.metrics import EXECUTIONS_IN_FLIGHT
+from executor.pool import ContainerPool, PoolExhausted, run_container
+from executor.timeout import ContainerTimeout, ExecTimeout, DaemonTimeout
+from executor.tracing import stage
 
 logger = logging.getLogger(__name__)
 
+# Extra seconds a batch container may take on top of the sum of all job timeouts
+BATCH_OVERHEAD = 5
+# Max bytes of the JSON argument of a single batch container. Linux limits every argument to 128 KiB (MAX_ARG_STRLEN)
+BATCH_ARGUMENT_LIMIT = 96 * 1024
+
+
+def is_internal_error(output: typing.Optional[bytes]) -> bool:
+    """ Whether the command could not be executed at all, instead of producing a (right or wrong) result """
+    try:
+        result = json.loads(output)
+    except (TypeError, ValueError):
+        return True
+    return not isinstance(result, dict) or bool(result.get('error'))
+
+
+def batch_chunks(requests: typing.List[dict], limit: int = BATCH_ARGUMENT_LIMIT) -> typing.Iterator[typing.List[dict]]:
+    """ Split the requests into consecutive chunks whose JSON encoding is at most limit bytes long """
+    chunk, size = [], 2
+    for request in requests:
+        # +2 for the separating ", "
+        request_size = len(json.dumps(request).encode('utf-8')) + 2
+        if chunk and size + request_size > limit:
+            yield chunk
+            chunk, size = [], 2
+        chunk.append(request)
+        size += request_size
+    if chunk:
+        yield chunk
+
 
 class CommandExecutor(object):
     """
@@ -31,10 +66,12 @@ class CommandExecutor(object):
 
     def __init__(self, config: DockerConfig = None):
         self.config: DockerConfig = config or DockerConfig()
-        self.execution_timeout: int = int(self.config.EXECUTION_TIMEOUT)
+        self.execution_timeout: float = float(self.config.EXECUTION_TIMEOUT)
         self.docker_image: str = self.config.DOCKER_IMAGE
         self.client: DockerClient = DockerClient()
         self.init_client()
+        self._pool: typing.Optional[ContainerPool] = None
+        self._pool_lock = threading.Lock()
 
     def init_client(self):
         if self.config.DOCKER_BASE_URL is None:
@@ -48,6 +85,34 @@ class CommandExecutor(object):
         )
         return client
 
+    @property
+    def pool(self) -> typing.Optional[ContainerPool]:
+        """ The container pool is created lazily, so that merely importing the executor does not start any containers """
+        if self.config.POOL_SIZE <= 0:
+            return None
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ContainerPool(self.client, self.docker_image, self.config.pool_container_arguments(), **self.config.pool_arguments())
+                self._pool.start()
+                atexit.register(self._pool.shutdown)
+        return self._pool
+
+    def pool_stats(self) -> typing.Optional[dict]:
+        return self._pool.stats() if self._pool else None
+
+    def shutdown(self) -> None:
+        if self._pool:
+            self._pool.shutdown()
+
+    @staticmethod
+    def clear_cache() -> None:
+        """ Forget all cached command outputs """
+        CommandExecutor.execute_command.__wrapped__.cache_clear()
+
+    @staticmethod
+    def cache_stats() -> dict:
+        return CommandExecutor.execute_command.__wrapped__.cache_info()._asdict()
+
     @property
     def images(self) -> typing.List:
         return self.client.images.list()
@@ -63,27 +128,118 @@ class CommandExecutor(object):
         docker_cmd = (self.config.COMMAND_RUNNER_PATH,) + command
         return docker_cmd
 
-    def run_command(self, command: typing.Tuple[str], challenge: str) -> bytes:
-        docker_cmd = (challenge,) + command
+    @staticmethod
+    def canonical_command(command: typing.Tuple[str]) -> typing.Tuple[str]:
+        """
+        The runner joins all arguments with single spaces and runs the result with bash -c.
+        So every command is passed as a single, whitespace normalized argument,
+        which makes equivalent commands share the same lru_cache entry.
+        """
+        return (" ".join(" ".join(command).split()),)
+
+    def run_command(self, command: typing.Tuple[str], challenge: str, version: str = None) -> bytes:
+        docker_cmd = (challenge,) + self.canonical_command(command)
         docker_cmd = self.prepend_python_runner_path(docker_cmd)
-        docker_output = self.execute_command(tuple(docker_cmd), challenge)
+        try:
+            docker_output = self.execute_command(tuple(docker_cmd), challenge, challenge_version=version)
+        except UncacheableOutput as error:
+            docker_output = error.output
         return docker_output
 
-    def run_command_parsed(self, command: typing.Tuple[str], challenge: str) -> typing.Optional[dict]:
-        docker_output = self.run_command(command, challenge)
+    def run_command_parsed(self, command: typing.Tuple[str], challenge: str, version: str = None) -> typing.Optional[dict]:
+        docker_output = self.run_command(command, challenge, version=version)
         try:
-            return json.loads(docker_output)
+            with stage("json_parse"):
+                return json.loads(docker_output)
         except JSONDecodeError:
             logger.error("Docker response could not be JSON parsed. It was: ", docker_output)
             return None
 
+    def run_batch(self, jobs: typing.Iterable[typing.Tuple[typing.Tuple[str], str]], timeout: float = None) -> typing.List[typing.Optional[dict]]:
+        """
+        Run many (command, challenge) pairs one after another inside a single container.
+        Challenge directories are restored between the jobs and every job has its own timeout.
+        The jobs are passed as a command line argument, so large batches are split across several containers.
+        Returns one parsed result per job. Results are not cached.
+        """
+        job_timeout = timeout or self.execution_timeout
+        requests = [
+            dict(
+                challenge=challenge,
+                command=list(self.canonical_command(command)),
+                working_dir=self.get_challenge_directory_from_challenge_name(challenge),
+                timeout=job_timeout
+            )
+            for command, challenge in jobs
+        ]
+        results = []
+        for chunk in batch_chunks(requests):
+            results.extend(self._run_batch(chunk, job_timeout))
+        return results
+
+    def _run_batch(self, requests: typing.List[dict], job_timeout: float) -> typing.List[typing.Optional[dict]]:
+        docker_cmd = self.prepend_python_runner_path(("--batch", json.dumps(requests)))
+        batch_timeout = job_timeout * len(requests) + BATCH_OVERHEAD
+        with ContainerTimeout(timeout=batch_timeout, output_limit=self.config.response_limit() * len(requests)) as context:
+            container = run_container(self.client, self.docker_image, docker_cmd, **self.config.isolated_runner_arguments(), working_dir=self.config.WORKING_DIR)
+            context.container = container
+
+        try:
+            results = json.loads(context.container_output)
+        except (TypeError, JSONDecodeError):
+            logger.error(f"Batch response could not be JSON parsed. It was: {context.container_output}")
+            return [None] * len(requests)
+        if isinstance(results, list) and len(results) != len(requests):
+            logger.error(f"Batch returned {len(results)} results for {len(requests)} jobs")
+            return [None] * len(requests)
+        if isinstance(results, dict):
+            # the batch failed as a whole, e.g. because it timed out
+            return [dict(results) for _ in requests]
+        return results
+
     @log_command
     @lru_cache(maxsize=2048)
-    def execute_command(self, command: typing.Tuple[str], challenge_name: str, custom_timeout: int = None) -> typing.Optional[bytes]:
+    def execute_command(self, command: typing.Tuple[str], challenge_name: str, custom_timeout: float = None,
+                        challenge_version: str = None) -> typing.Optional[bytes]:
+        # challenge_version is not used for the execution itself, but makes it part of the lru_cache key
+        with EXECUTIONS_IN_FLIGHT.track(), stage("execute"):
+            output = self._execute_command(command, challenge_name, custom_timeout)
+        if is_internal_error(output):
+            # lru_cache does not remember exceptions, so the command is executed again next time
+            raise UncacheableOutput(output)
+        return output
+
+    def _execute_command(self, command: typing.Tuple[str], challenge_name: str, custom_timeout: float = None) -> typing.Optional[bytes]:
         timeout = custom_timeout or self.execution_timeout
         challenge_dir = self.get_challenge_directory_from_challenge_name(challenge_name)
-        with ContainerTimeout(timeout=timeout) as context:
-            container = self.client.containers.run(self.docker_image, command, **self.config.runner_arguments(), working_dir=challenge_dir)
+        pool = self.pool
+        if pool:
+            try:
+                if self.config.POOL_RUNNER_DAEMON:
+                    return self.execute_command_in_daemon(pool, command, challenge_name, challenge_dir, timeout)
+                return self.execute_command_in_pool(pool, command, challenge_dir, timeout)
+            except PoolExhausted as error:
+                logger.warning(f"Falling back to a new container: {error}")
+
+        with ContainerTimeout(timeout=timeout, output_limit=self.config.response_limit()) as context:
+            container = run_container(self.client, self.docker_image, command, **self.config.runner_arguments(), working_dir=challenge_dir)
             context.container = container
 
         return context.container_output
+
+    def execute_command_in_daemon(self, pool: ContainerPool, command: typing.Tuple[str], challenge_name: str, challenge_dir: str,
+                                  timeout: float) -> typing.Optional[bytes]:
+        with DaemonTimeout(pool, timeout=timeout, output_limit=self.config.response_limit()) as context:
+            context.challenge = challenge_name
+            # strip the runner path and the challenge name, the daemon only needs the command itself
+            context.command = command[2:]
+            context.working_dir = challenge_dir
+
+        return context.container_output
+
+    def execute_command_in_pool(self, pool: ContainerPool, command: typing.Tuple[str], challenge_dir: str, timeout: float) -> typing.Optional[bytes]:
+        with ExecTimeout(pool, timeout=timeout, output_limit=self.config.response_limit()) as context:
+            context.command = command
+            context.working_dir = challenge_dir
+
+        return context.container_output
@@ -2,27 +2,36 @@
 Custom Context manager for limiting the total execution time of a docker container.
 """
 import logging
-import time
+import typing
 
 from docker.errors import ContainerError, NotFound, APIError
 from requests import HTTPError
-from requests.exceptions import SSLError
+from requests.exceptions import SSLError, ReadTimeout, ConnectionError as RequestsConnectionError
+
+from executor.daemon import DaemonConnection
+from executor.exceptions import OutputLimitExceeded
+from executor.metrics import CONTAINER_LATENCY, EXECUTION_FAILURES
+from executor.tracing import stage
 
 TIMEOUT_RESPONSE = b"""{"success":false, "output":"Command timed out"}"""
-DEFAULT_FAIL_RESPONSE = b"""{"success":false, "output":"Docker execution failed."}"""
+# "error" marks failures that are not the command's fault. They are never cached
+DEFAULT_FAIL_RESPONSE = b"""{"success":false, "output":"Docker execution failed.", "error":true}"""
+OUTPUT_LIMIT_RESPONSE = b"""{"success":false, "output":"Command produced too much output.", "truncated":true}"""
 
 logger = logging.getLogger(__name__)
 
 
 class ContainerTimeout(object):
     """
-    This is a context mananger which periodically checks the output of a 
-    docker container and kills it, if a certain timeout has passed.
+    This is a context mananger which waits for a docker container to exit
+    and kills it, if a certain timeout (in seconds, may be a float) has passed.
+    The output is streamed and at most output_limit bytes are read.
     """
 
-    def __init__(self, timeout=5):
+    def __init__(self, timeout: float = 5, output_limit: int = None):
         self.container = None
         self.timeout = timeout
+        self.output_limit = output_limit
         self.container_output = None
 
     def __enter__(self):
@@ -34,36 +43,146 @@ class ContainerTimeout(object):
         Removes container afterwards.
         Also stops long running containers
         """
+        if exc_type is not None:
+            # the container could not be created or started, there is nothing to wait for
+            logger.error(f"Could not start the container: {exc_value}")
+            EXECUTION_FAILURES.inc(reason="start")
+            self.container_output = DEFAULT_FAIL_RESPONSE
+            if self.container:
+                self.cleanup()
+            return True
         try:
             self.wait_for_output()
         except ContainerError as error:
             logger.error(error)
+            EXECUTION_FAILURES.inc(reason="container_error")
             self.container_output = DEFAULT_FAIL_RESPONSE
         except (SSLError, NotFound, APIError, HTTPError) as error:
             logger.error(error)
+            EXECUTION_FAILURES.inc(reason=type(error).__name__)
             self.container_output = DEFAULT_FAIL_RESPONSE
         except TimeoutError:
             logger.warning("Container timed out!")
+            EXECUTION_FAILURES.inc(reason="timeout")
             self.container_output = TIMEOUT_RESPONSE
+        except OutputLimitExceeded as error:
+            logger.warning(error)
+            EXECUTION_FAILURES.inc(reason="output_limit")
+            self.container_output = OUTPUT_LIMIT_RESPONSE
+        except ConnectionError as error:
+            logger.error(error)
+            EXECUTION_FAILURES.inc(reason="connection")
+            self.container_output = DEFAULT_FAIL_RESPONSE
         finally:
             if self.container:
                 # always clean up
-                self.container.stop()
-                self.container.remove()
+                self.cleanup()
             # always suppress exceptions
             return True
 
+    def cleanup(self):
+        with stage("container_remove", CONTAINER_LATENCY, stage="remove"):
+            self.container.stop()
+            self.container.remove()
+
     def wait_for_output(self):
         """
-        Wait timeout seconds for container to finish.
+        Block until the container exits, but at most timeout seconds.
         Raises an TimeoutError if the containers runs longer than timeout.
         """
-        i = 0
-        while True:
-            self.container_output = self.container.logs()
-            if self.container_output:
-                return True
-            i += 1
-            if i >= self.timeout:
-                raise TimeoutError()
-            time.sleep(1)
+        try:
+            with stage("container_wait", CONTAINER_LATENCY, stage="wait"):
+                self.container.wait(timeout=self.timeout)
+        except SSLError:
+            raise
+        except (ReadTimeout, RequestsConnectionError) as error:
+            # docker-py surfaces an expired wait timeout as one of these
+            raise TimeoutError() from error
+        with stage("container_logs"):
+            self.container_output = self.read_limited(self.container.logs(stream=True))
+        return True
+
+    def read_limited(self, chunks: typing.Iterable[bytes]) -> bytes:
+        """ Join the chunks. Raises OutputLimitExceeded as soon as they exceed output_limit bytes """
+        output = bytearray()
+        for chunk in chunks:
+            output += chunk
+            if self.output_limit and len(output) > self.output_limit:
+                raise OutputLimitExceeded(f"Container produced more than {self.output_limit} bytes")
+        return bytes(output)
+
+
+class ExecTimeout(ContainerTimeout):
+    """
+    Same as the ContainerTimeout, but for commands that are exec'd inside an already running container borrowed from a ContainerPool.
+    The command is wrapped with coreutils' timeout, which kills it if it runs longer than timeout seconds.
+    The container is returned to the pool afterwards instead of being removed.
+    """
+    TIMEOUT_EXIT_CODES = (124, 137)
+
+    def __init__(self, pool, timeout: float = 5, output_limit: int = None):
+        super().__init__(timeout=timeout, output_limit=output_limit)
+        self.pool = pool
+        self.pooled = None
+        self.command = None
+        self.working_dir = None
+        self.reusable = False
+
+    def __enter__(self):
+        with stage("pool_acquire"):
+            self.pooled = self.pool.acquire(timeout=self.timeout)
+        self.container = self.pooled.container
+        return self
+
+    def wrap_command(self) -> tuple:
+        # git does not track empty challenge directories, so the working directory is created first ($0 of the script)
+        return (
+            ("sh", "-c", 'mkdir -p "$0" && cd "$0" && exec "$@"', self.working_dir or "/")
+            + ("timeout", "--signal=KILL", str(self.timeout))
+            + tuple(self.command)
+        )
+
+    def wait_for_output(self):
+        """
+        Exec the command and wait for it to finish.
+        Raises an TimeoutError if the command was killed because it ran longer than timeout.
+        """
+        api = self.container.client.api
+        with stage("container_exec", CONTAINER_LATENCY, stage="exec"):
+            exec_id = api.exec_create(self.container.id, self.wrap_command())['Id']
+            self.container_output = self.read_limited(api.exec_start(exec_id, stream=True))
+            exit_code = api.exec_inspect(exec_id)['ExitCode']
+        if exit_code in self.TIMEOUT_EXIT_CODES:
+            raise TimeoutError()
+        return True
+
+    def cleanup(self):
+        self.pool.release(self.pooled, reusable=self.reusable)
+
+
+class DaemonTimeout(ExecTimeout):
+    """
+    Hands the command to the runner daemon (run_cmd --serve) of a pooled container, instead of exec'ing a new runner.
+    The daemon enforces the timeout itself. The connection gets a small grace period on top of that,
+    after which the container is considered to be stuck and is recycled.
+    """
+    GRACE_PERIOD = 1.0
+
+    def __init__(self, pool, timeout: float = 5, output_limit: int = None):
+        super().__init__(pool, timeout=timeout, output_limit=output_limit)
+        self.challenge = None
+
+    def wait_for_output(self):
+        if self.pooled.connection is None:
+            self.pooled.connection = DaemonConnection(self.container)
+        payload = dict(
+            challenge=self.challenge,
+            command=list(self.command),
+            working_dir=self.working_dir,
+            timeout=self.timeout
+        )
+        with stage("daemon_request", CONTAINER_LATENCY, stage="daemon"):
+            self.container_output = self.pooled.connection.request(payload, timeout=self.timeout + self.GRACE_PERIOD, max_size=self.output_limit)
+        # the daemon answered properly and can serve the next command
+        self.reusable = True
+        return True
@@ -0,0 +1,94 @@
+"""
+Lightweight per-request tracing.
+
+A Trace collects the duration of every stage a request passes through (parsing, cache lookups, container start, ...).
+Traces are bound to the current thread, so stages that run in other threads (e.g. async jobs) are not recorded.
+Stages outside of a (sampled) trace are only timed, if they also feed a histogram.
+"""
+import random
+import threading
+import time
+import typing
+import uuid
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class Trace(object):
+
+    def __init__(self, name: str):
+        self.id: str = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started: float = time.perf_counter()
+        self.finished: typing.Optional[float] = None
+        self.stages: typing.List[typing.Tuple[str, float]] = []
+
+    def __repr__(self):
+        return f"<Trace {self.id} {self.name}>"
+
+    def record(self, stage: str, duration: float) -> None:
+        self.stages.append((stage, duration))
+
+    @property
+    def duration(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def to_dict(self) -> dict:
+        return dict(
+            trace_id=self.id,
+            name=self.name,
+            duration=round(self.duration, 6),
+            stages=[dict(stage=stage, duration=round(duration, 6)) for stage, duration in self.stages]
+        )
+
+    def server_timing(self) -> str:
+        """ Value for the Server-Timing header. Durations are in milliseconds """
+        stages = [f"{stage};dur={duration * 1000:.2f}" for stage, duration in self.stages]
+        stages.append(f"total;dur={self.duration * 1000:.2f}")
+        return ", ".join(stages)
+
+
+def current_trace() -> typing.Optional[Trace]:
+    return getattr(_local, "trace", None)
+
+
+def start_trace(name: str, sample_rate: float = 1.0) -> typing.Optional[Trace]:
+    """ Start a trace for the current thread with a probability of sample_rate """
+    trace = Trace(name) if sample_rate > 0 and random.random() < sample_rate else None
+    _local.trace = trace
+    return trace
+
+
+def finish_trace() -> typing.Optional[Trace]:
+    """ Stop and return the trace of the current thread, if any """
+    trace = current_trace()
+    _local.trace = None
+    if trace:
+        trace.finished = time.perf_counter()
+    return trace
+
+
+def record_stage(name: str, duration: float) -> None:
+    """ Add a stage that was timed elsewhere to the current trace """
+    trace = current_trace()
+    if trace:
+        trace.record(name, duration)
+
+
+@contextmanager
+def stage(name: str, histogram=None, **labels) -> typing.Iterator[None]:
+    """ Time the code block as a stage of the current trace. The duration is also observed by histogram, if given """
+    trace = current_trace()
+    if trace is None and histogram is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        if histogram is not None:
+            histogram.observe(duration, **labels)
+        if trace is not None:
+            trace.record(name, duration)
@@ -1,7 +1,13 @@
 from flask import Flask, jsonify
 
+from server.cache_eviction import cache_sweeper
+from server.commandlog import command_log
 from server.config import config as app_settings
 from server.extensions import init_extensions, db
+from server.identifiers import identifier_tracker
+from server.metrics import init_metrics
+from server.registry import challenge_registry, badge_registry
+from server.tracing import init_tracing
 
 
 def create_app(script_info=None):
@@ -16,6 +22,21 @@ def create_app(script_info=None):
     # set up extensions
     init_extensions(app)
 
+    # in-memory challenges and badges
+    challenge_registry.init_app(app)
+    badge_registry.init_app(app)
+
+    # deduplicated, write-behind tracking of user identifiers
+    identifier_tracker.init_app(app)
+    command_log.init_app(app)
+
+    # hit counting and eviction of the CommandCache table
+    cache_sweeper.init_app(app)
+
+    # request latency metrics and per-stage tracing
+    init_metrics(app)
+    init_tracing(app)
+
     # Views
     init_blueprints(app)
 
@@ -1,51 +1,113 @@
+import datetime
 import functools
 import hashlib
+import logging
 import typing
 
+from flask import current_app
+
+from executor.decorators import trace_stage
+from server.cache_eviction import cache_sweeper
+from server.extensions import command_cache_l1, coalescer
+from server.metrics import COMMAND_CACHE_LOOKUPS
 from server.models import CommandCache
+from server.parse import normalize_command
+from server.versions import challenge_version
+
+logger = logging.getLogger(__name__)
 
 
 def hash_cmd(command: str):
-    """ Compute a SHA-224 hash for a given string """
-    command_encoded = command.encode('utf-8')
+    """ Compute a SHA-224 hash for the canonical form of a given command """
+    command_encoded = normalize_command(command).encode('utf-8')
     digest = hashlib.sha224(command_encoded).hexdigest()
     return digest
 
 
+def cache_key(command: str, challenge_identifier: str) -> typing.Tuple[str, str, str]:
+    """ Results are only valid for the version of the challenge they were computed for """
+    return hash_cmd(command), challenge_identifier, challenge_version(challenge_identifier)
+
+
+@trace_stage("cache_database")
 def get_from_cache(command: str, challenge_identifier: str) -> typing.Optional[CommandCache]:
-    """ Query the database for that command. PK is (hash of cmd, challenge_id)"""
+    """ Query the database for that command. PK is (hash of cmd, challenge_id). Rows of older challenge versions are ignored """
     c = CommandCache.get_by_pks(hash=hash_cmd(command), challenge_identifier=challenge_identifier)
+    if c and c.challenge_version != challenge_version(challenge_identifier):
+        return None
     return c
 
 
+@trace_stage("cache_store")
 def cache(command: str, challenge_identifier: str, result: dict) -> CommandCache:
-    """Store the command and it's output in cache"""
-    c = CommandCache.create(
-        hash=hash_cmd(command),
-        challenge_identifier=challenge_identifier,
-        cmd_correct=result['success'],
-        cmd_output=result['output']
-    )
+    """Store the command and it's output in cache. Replaces rows of older challenge versions"""
+    c = CommandCache.get_by_pks(hash=hash_cmd(command), challenge_identifier=challenge_identifier)
+    if not c:
+        c = CommandCache(hash=hash_cmd(command), challenge_identifier=challenge_identifier)
+    c.challenge_version = challenge_version(challenge_identifier)
+    c.timestamp = datetime.datetime.now()
+    c.last_access = c.timestamp
+    c.hits = 0
+    c.cmd_correct = result['success']
+    c.set_output(result['output'], current_app.config.get('COMMAND_CACHE_COMPRESS_MIN_SIZE', 1024))
+    c = c.save()
+    cache_sweeper.maybe_sweep()
     return c
 
 
+@trace_stage("cache_memory")
+def get_from_memory(command: str, challenge_identifier: str) -> typing.Optional[dict]:
+    """ Look the command up in the in-process cache. Returns a dict with the keys success and output """
+    return command_cache_l1.get(cache_key(command, challenge_identifier))
+
+
+def store_in_memory(command: str, challenge_identifier: str, success: bool, output: str) -> None:
+    command_cache_l1.set(cache_key(command, challenge_identifier), dict(success=success, output=output))
+
+
+def execute_and_cache(func: typing.Callable, command: str, challenge_identifier: str, **kwargs) -> typing.Optional[dict]:
+    # a previous flight for the same command may have finished in the meantime
+    memory_result = get_from_memory(command, challenge_identifier)
+    if memory_result:
+        return dict(memory_result, cached=True)
+    result: dict = func(command, challenge_identifier, **kwargs)
+    if not result or result.get('error'):
+        # the command could not be executed, which says nothing about the command itself
+        return result
+    result['cached'] = False
+    cache(command, challenge_identifier, result)
+    store_in_memory(command, challenge_identifier, result['success'], result['output'])
+    return result
+
+
 def cache_command():
     """
     Wrapper around the run_cmd function.
     Only execute the called function if the command is not cached.
+    The in-process cache is checked first, the CommandCache table second.
     Also makes sure to cache non-cached function for future use.
+    Concurrent calls for the same uncached command share a single execution.
     """
     def wrapper(func):
         @functools.wraps(func)
-        def wrap_func(command: str, challenge_identifier: str):
+        def wrap_func(command: str, challenge_identifier: str, **kwargs):
+            memory_result = get_from_memory(command, challenge_identifier)
+            if memory_result:
+                COMMAND_CACHE_LOOKUPS.inc(tier="memory", result="hit")
+                cache_sweeper.record_hit(hash_cmd(command), challenge_identifier)
+                return dict(memory_result, cached=True)
+            COMMAND_CACHE_LOOKUPS.inc(tier="memory", result="miss")
+            logger.debug(f"In-process command cache miss: {command_cache_l1.stats()}")
+
             cached_result = get_from_cache(command, challenge_identifier)
-            if cached_result:
-                result: dict = dict(success=cached_result.cmd_correct, output=cached_result.cmd_output, cached=True)
-            else:
-                result: dict = func(command, challenge_identifier)
-                result['cached'] = False
-                cache(command, challenge_identifier, result)
-            return result
+            COMMAND_CACHE_LOOKUPS.inc(tier="database", result="hit" if cached_result else "miss")
+            if not cached_result:
+                return coalescer.do(cache_key(command, challenge_identifier), execute_and_cache, func, command, challenge_identifier, **kwargs)
+
+            cache_sweeper.record_hit(cached_result.hash, challenge_identifier)
+            output = cached_result.output
+            store_in_memory(command, challenge_identifier, cached_result.cmd_correct, output)
+            return dict(success=cached_result.cmd_correct, output=output, cached=True)
 
         return wrap_func
 
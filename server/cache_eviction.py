@@ -0,0 +1,193 @@
+"""
+Keeps the CommandCache table small and hot.
+
+Every cache hit is recorded (in batches, off the request path) as hit count and last access of the row.
+The sweeper evicts rows that were not accessed for max_age seconds, rows that were hit less than min_hits times
+within min_hits_age seconds after they were stored (e.g. typos) and then the least used rows,
+until the table holds at most max_rows rows and max_bytes bytes of output.
+"""
+import datetime
+import logging
+import threading
+import time
+import typing
+from collections import namedtuple
+
+from flask import Flask
+from sqlalchemy import func, and_, or_, true
+
+from server.extensions import db
+from server.models import CommandCache
+from server.writebehind import WriteBehind
+
+logger = logging.getLogger(__name__)
+
+DELETE_CHUNK_SIZE = 500
+
+# A limit of 0 disables the corresponding eviction
+CacheLimits = namedtuple("CacheLimits", ["max_rows", "max_bytes", "max_age", "min_hits", "min_hits_age"])
+
+
+def limits_from_config(config: dict) -> CacheLimits:
+    return CacheLimits(
+        max_rows=config.get('COMMAND_CACHE_MAX_ROWS', 0),
+        max_bytes=config.get('COMMAND_CACHE_MAX_BYTES', 0),
+        max_age=config.get('COMMAND_CACHE_MAX_AGE', 0),
+        min_hits=config.get('COMMAND_CACHE_MIN_HITS', 0),
+        min_hits_age=config.get('COMMAND_CACHE_MIN_HITS_AGE', 0),
+    )
+
+
+def store_hits(hits: typing.List[typing.Tuple[str, str, datetime.datetime]]) -> None:
+    """ Add the (hash, challenge, time) hits to the rows. A single UPDATE per row and a single commit """
+    aggregated: typing.Dict[typing.Tuple[str, str], typing.Tuple[int, datetime.datetime]] = {}
+    for hash_value, challenge_identifier, accessed in hits:
+        count, last_access = aggregated.get((hash_value, challenge_identifier), (0, accessed))
+        aggregated[(hash_value, challenge_identifier)] = (count + 1, max(last_access, accessed))
+    for (hash_value, challenge_identifier), (count, last_access) in aggregated.items():
+        CommandCache.query.filter(
+            CommandCache.hash == hash_value,
+            CommandCache.challenge_identifier == challenge_identifier
+        ).update({
+            CommandCache.hits: func.coalesce(CommandCache.hits, 0) + count,
+            CommandCache.last_access: last_access,
+        }, synchronize_session=False)
+    db.session.commit()
+
+
+def delete_rows(keys: typing.List[typing.Tuple[str, str]]) -> int:
+    for start in range(0, len(keys), DELETE_CHUNK_SIZE):
+        CommandCache.query.filter(or_(*(
+            and_(CommandCache.hash == hash_value, CommandCache.challenge_identifier == challenge_identifier)
+            for hash_value, challenge_identifier in keys[start:start + DELETE_CHUNK_SIZE]
+        ))).delete(synchronize_session=False)
+    return len(keys)
+
+
+def is_stale(version: typing.Optional[str], current_version: typing.Optional[str]):
+    """ Criterion of the rows of a challenge that were cached for another than its current version """
+    if current_version is None:
+        # the challenge was removed
+        return true()
+    return or_(version.is_(None), version != current_version)
+
+
+def stale_entries(versions: typing.Dict[str, str]) -> typing.Dict[str, int]:
+    """ Number of cached commands of outdated challenge versions per challenge. A single grouped COUNT """
+    stale: typing.Dict[str, int] = {}
+    rows = db.session.query(CommandCache.challenge_identifier, CommandCache.challenge_version, func.count()).group_by(
+        CommandCache.challenge_identifier, CommandCache.challenge_version
+    )
+    for challenge_identifier, version, count in rows:
+        if version is None or version != versions.get(challenge_identifier):
+            stale[challenge_identifier] = stale.get(challenge_identifier, 0) + count
+    return stale
+
+
+def purge_stale(versions: typing.Dict[str, str], challenge_identifiers: typing.Iterable[str]) -> int:
+    """ Delete the cached commands of outdated versions of the challenges. A single DELETE per challenge """
+    deleted = 0
+    for challenge_identifier in challenge_identifiers:
+        deleted += CommandCache.query.filter(
+            CommandCache.challenge_identifier == challenge_identifier,
+            is_stale(CommandCache.challenge_version, versions.get(challenge_identifier))
+        ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def sweep(limits: CacheLimits) -> typing.Dict[str, int]:
+    """ Evict rows according to limits. Returns the number of deleted rows per reason """
+    now = datetime.datetime.now()
+    last_used = func.coalesce(CommandCache.last_access, CommandCache.timestamp)
+    size = func.coalesce(CommandCache.output_size, func.length(CommandCache.cmd_output), 0)
+    deleted = dict(age=0, hits=0, rows=0, bytes=0)
+
+    if limits.max_age:
+        deleted['age'] = CommandCache.query.filter(
+            last_used < now - datetime.timedelta(seconds=limits.max_age)
+        ).delete(synchronize_session=False)
+
+    if limits.min_hits:
+        deleted['hits'] = CommandCache.query.filter(
+            func.coalesce(CommandCache.hits, 0) < limits.min_hits,
+            CommandCache.timestamp < now - datetime.timedelta(seconds=limits.min_hits_age)
+        ).delete(synchronize_session=False)
+
+    # least valuable rows first
+    by_value = db.session.query(CommandCache.hash, CommandCache.challenge_identifier, size).order_by(
+        func.coalesce(CommandCache.hits, 0).asc(),
+        last_used.asc()
+    )
+    if limits.max_rows:
+        excess = CommandCache.query.count() - limits.max_rows
+        if excess > 0:
+            deleted['rows'] = delete_rows([(hash_value, challenge) for hash_value, challenge, _ in by_value.limit(excess)])
+
+    if limits.max_bytes:
+        excess = (db.session.query(func.sum(size)).scalar() or 0) - limits.max_bytes
+        keys = []
+        for hash_value, challenge_identifier, row_size in by_value.yield_per(1000):
+            if excess <= 0:
+                break
+            keys.append((hash_value, challenge_identifier))
+            excess -= row_size or 0
+        deleted['bytes'] = delete_rows(keys)
+
+    db.session.commit()
+    logger.info(f"Evicted cached commands: {deleted}")
+    return deleted
+
+
+class CacheSweeper(object):
+    """
+    Records cache hits and sweeps the CommandCache table in the background every interval seconds.
+    Sweeps are triggered by stores into the cache, so an idle server does not sweep. An interval of 0 disables them.
+    """
+
+    def __init__(self):
+        self.app: typing.Optional[Flask] = None
+        self.interval: float = 0
+        self.limits = CacheLimits(0, 0, 0, 0, 0)
+        self.hits = WriteBehind(store_hits, name="cache-hits")
+        self._last_sweep: float = time.monotonic()
+        self._sweeping = False
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        self.interval = app.config.get('COMMAND_CACHE_SWEEP_INTERVAL', self.interval)
+        self.limits = limits_from_config(app.config)
+        self.hits.init_app(app)
+
+    def record_hit(self, hash_value: str, challenge_identifier: str) -> None:
+        self.hits.put((hash_value, challenge_identifier, datetime.datetime.now()))
+
+    def maybe_sweep(self) -> None:
+        """ Start a sweep in a background thread, if the last one is at least interval seconds ago """
+        if not self.interval or self.app is None:
+            return
+        with self._lock:
+            if self._sweeping or time.monotonic() - self._last_sweep < self.interval:
+                return
+            self._sweeping = True
+        threading.Thread(target=self._sweep, name="cache-sweeper", daemon=True).start()
+
+    def _sweep(self) -> None:
+        try:
+            with self.app.app_context():
+                # store the pending hits first, so that recently used rows survive
+                self.hits.flush()
+                sweep(self.limits)
+        except Exception as error:
+            logger.exception(f"Could not sweep the command cache: {error}")
+        finally:
+            with self._lock:
+                self._sweeping = False
+                self._last_sweep = time.monotonic()
+
+    def stats(self) -> dict:
+        return self.hits.stats()
+
+
+cache_sweeper = CacheSweeper()
@@ -2,10 +2,14 @@ import logging
 import os
 from functools import lru_cache
 
+from executor.tracing import record_stage
+
 from server.cache import cache_command
 from server.decorators import log_cache_status
-from server.extensions import c
+from server.extensions import c, scheduler
 from server.parse import split_command
+from server.scheduler import Client
+from server.versions import challenge_version
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +28,11 @@ def load_challenge_file() -> str:
 
 
 @cache_command()
-def execute_command(command: str, challenge_identifier: str) -> dict:
+def execute_command(command: str, challenge_identifier: str, client: Client = None) -> dict:
     cmd_split = tuple(split_command(command))
-    result: dict = c.run_command_parsed(cmd_split, challenge=challenge_identifier)
+    with scheduler.admit(client) as ticket:
+        result: dict = c.run_command_parsed(cmd_split, challenge=challenge_identifier, version=challenge_version(challenge_identifier))
+    record_stage("queue_wait", ticket.wait_time)
+    if result is not None:
+        result['queue_wait'] = ticket.wait_time
     return result
@@ -0,0 +1,80 @@
+"""
+Single flight execution: concurrent calls with the same key share one execution.
+
+If a whole class types in the same solution at once, only the first request executes it.
+Everyone else waits for that execution to finish and receives a copy of its result.
+Errors that only concern the caller who executed, e.g. its client was not admitted, are not shared:
+the waiting callers try again and one of them executes instead.
+"""
+import threading
+import typing
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: typing.Optional[BaseException] = None
+
+
+class SingleFlight(object):
+    """
+    private_errors:  exception types that are only raised to the caller who executed
+    """
+
+    def __init__(self, private_errors: typing.Tuple[typing.Type[BaseException], ...] = ()):
+        self.private_errors = private_errors
+        self._calls: typing.Dict[typing.Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.executed: int = 0
+        self.coalesced: int = 0
+        self.retried: int = 0
+
+    @staticmethod
+    def _copy(result):
+        # callers tend to modify the result, so everyone, including the caller who executed, gets their own copy
+        return dict(result) if isinstance(result, dict) else result
+
+    def do(self, key: typing.Hashable, func: typing.Callable, *args, **kwargs):
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self.executed += 1
+                else:
+                    self.coalesced += 1
+
+            if leader:
+                break
+
+            call.done.wait()
+            if isinstance(call.error, self.private_errors):
+                # e.g. the client of the leader was rejected. Try again, probably as the new leader
+                with self._lock:
+                    self.retried += 1
+                continue
+            if call.error is not None:
+                raise call.error
+            return self._copy(call.result)
+
+        try:
+            call.result = func(*args, **kwargs)
+            return self._copy(call.result)
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                in_flight=len(self._calls),
+                executed=self.executed,
+                coalesced=self.coalesced,
+                retried=self.retried,
+            )
@@ -0,0 +1,127 @@
+"""
+Optional write-behind log of the submitted commands (COMMAND_LOG_WRITE_BEHIND).
+
+Logging a submission synchronously takes two to four commits (command, counters, solved challenge, badges).
+With the write-behind log, a submission only becomes a record inside a bounded in-process buffer.
+A background thread stores the records in batches with a single commit and the rest is flushed when the process exits.
+Badges are still evaluated on the request, against the stored state plus the user's pending records,
+so that the response (and /user/<uuid>/state) can read its own writes.
+"""
+import datetime
+import logging
+import typing
+
+from flask import Flask
+
+from server.extensions import db
+from server.models import User, Badge, GameModes, SubmittedCommand, SolvedChallenges, badges_user_association_table
+from server.writebehind import WriteBehind
+
+logger = logging.getLogger(__name__)
+
+
+class PendingUserView(object):
+    """ Counters and badges of a user including its pending records. Used to evaluate the badge conditions """
+
+    def __init__(self, user: User, pending: typing.List[dict]):
+        self.uuid = user.uuid
+        self.correct_command_count = user.correct_command_count + sum(1 for record in pending if record['solved_challenge'])
+        self.wrong_command_count = user.wrong_command_count + sum(1 for record in pending if not record['solved_challenge'])
+        self.solved_challenge_count = user.solved_challenge_count + sum(1 for record in pending if record['new_solve'])
+        self.badge_ids = user.badge_ids | {badge_id for record in pending for badge_id in record['badges']}
+
+
+def store_records(records: typing.List[dict]) -> None:
+    """ Store a batch of submission records with a single commit """
+    db.session.bulk_insert_mappings(SubmittedCommand, [
+        dict(
+            user_uuid=record['user_uuid'],
+            command_string=record['command_string'],
+            challenge_id=record['challenge_id'],
+            solved_challenge=record['solved_challenge'],
+            time_submitted=record['time_submitted']
+        )
+        for record in records
+    ])
+
+    counters: typing.Dict[str, dict] = {}
+    for record in records:
+        counter = counters.setdefault(record['user_uuid'], dict(correct=0, wrong=0, solved=0, last_seen=record['time_submitted']))
+        counter['correct' if record['solved_challenge'] else 'wrong'] += 1
+        counter['last_seen'] = max(counter['last_seen'], record['time_submitted'])
+
+    for user_uuid, challenge_id in {(record['user_uuid'], record['challenge_id']) for record in records if record['new_solve']}:
+        if not SolvedChallenges.query.get((user_uuid, challenge_id)):
+            db.session.add(SolvedChallenges(user_id=user_uuid, challenge_id=challenge_id))
+            counters[user_uuid]['solved'] += 1
+
+    for user_uuid, counter in counters.items():
+        User.query.filter(User.uuid == user_uuid).update({
+            User.correct_count: User.correct_count + counter['correct'],
+            User.wrong_count: User.wrong_count + counter['wrong'],
+            User.solved_count: User.solved_count + counter['solved'],
+            User.last_seen: counter['last_seen'],
+        }, synchronize_session=False)
+
+    earned = {(record['user_uuid'], badge_id) for record in records for badge_id in record['badges']}
+    if earned:
+        table = badges_user_association_table
+        owned = set(db.session.query(table.c.user_id, table.c.badge_id).filter(table.c.user_id.in_({user_uuid for user_uuid, _ in earned})))
+        new = [dict(user_id=user_uuid, badge_id=badge_id) for user_uuid, badge_id in earned - owned]
+        if new:
+            db.session.execute(table.insert(), new)
+    db.session.commit()
+
+
+class CommandLog(object):
+
+    def __init__(self):
+        self.enabled: bool = False
+        self.buffer = WriteBehind(store_records, name="command-log")
+
+    def init_app(self, app: Flask) -> None:
+        self.enabled = app.config.get('COMMAND_LOG_WRITE_BEHIND', self.enabled)
+        self.buffer.init_app(app)
+
+    def pending_for(self, user_uuid: str) -> typing.List[dict]:
+        return [record for record in self.buffer.pending() if record['user_uuid'] == user_uuid]
+
+    def log(self, user: User, command: str, challenge: str, solved: bool) -> None:
+        """ Buffer the submission. Badges the user earned with it are evaluated right away """
+        pending = self.pending_for(user.uuid)
+        record = dict(
+            user_uuid=user.uuid,
+            command_string=command,
+            challenge_id=challenge,
+            solved_challenge=solved,
+            time_submitted=datetime.datetime.now(),
+            new_solve=solved and not self.has_solved(user, challenge, pending),
+            badges=[]
+        )
+        if user.mode == GameModes.BADGE:
+            view = PendingUserView(user, pending + [record])
+            earned: typing.Set[Badge] = Badge.earned_through_action(view, command, challenge if solved else None)
+            record['badges'] = [badge.id for badge in earned]
+        self.buffer.put(record)
+
+    @staticmethod
+    def has_solved(user: User, challenge: str, pending: typing.List[dict]) -> bool:
+        if any(record['challenge_id'] == challenge and record['new_solve'] for record in pending):
+            return True
+        return SolvedChallenges.query.get((user.uuid, challenge)) is not None
+
+    def badge_ids(self, user: User) -> typing.Set[int]:
+        """ Badges of the user, including the ones that were not stored yet """
+        return user.badge_ids | {badge_id for record in self.pending_for(user.uuid) for badge_id in record['badges']}
+
+    def solved_challenges(self, user: User) -> typing.List[str]:
+        """ Identifiers of the challenges the user solved, including the ones that were not stored yet """
+        solved = [challenge.challenge_id for challenge in user.solved_challenges]
+        solved += [record['challenge_id'] for record in self.pending_for(user.uuid) if record['new_solve'] and record['challenge_id'] not in solved]
+        return solved
+
+    def stats(self) -> dict:
+        return self.buffer.stats()
+
+
+command_log = CommandLog()
@@ -4,7 +4,13 @@ import typing
 from flask import Request
 from werkzeug.datastructures import Headers
 
+from executor.decorators import trace_stage
+from executor.tracing import stage
+from server.challenges import execute_command
+from server.commandlog import command_log
+from server.crud import unit_of_work
 from server.models import User, Badge, GameModes
+from server.scheduler import Client
 
 logger = logging.getLogger(__name__)
 
@@ -14,18 +20,40 @@ def get_user(headers: Headers):
     return User.query.get(uuid)
 
 
+@trace_stage("log_command")
 def log_command(user: User, command: str, challenge: str, result: dict) -> None:
-    user.add_command(
-        command_string=command,
-        challenge_id=challenge,
-        solved=result.get('success', False)
-    )
-    if user.mode == GameModes.BADGE:
-        applicable_badges: typing.Set[Badge] = Badge.earned_through_action(user, command)
-        user.add_new_badges(applicable_badges)
+    if command_log.enabled:
+        with stage("badges"):
+            command_log.log(user, command, challenge, result.get('success', False))
+        return
+    # a single commit for the command, the counters, the solved challenge and the badges
+    with unit_of_work():
+        user.add_command(
+            command_string=command,
+            challenge_id=challenge,
+            solved=result.get('success', False)
+        )
+        if user.mode == GameModes.BADGE:
+            with stage("badges"):
+                solved_challenge = challenge if result.get('success', False) else None
+                applicable_badges: typing.Set[Badge] = Badge.earned_through_action(user, command, solved_challenge)
+                user.add_new_badges(applicable_badges)
     logger.debug(f"User {user.uuid} submitted a solution for {challenge}. His command was [{command}] and it was {'true' if result['success'] else 'false'}.")
 
 
+def run_submission(command: str, challenge: str, user_uuid: typing.Optional[str], client: Client = None) -> typing.Optional[dict]:
+    """ Execute the command and log it for the user (if any). Returns None if the command could not be executed """
+    result: dict = execute_command(command, challenge, client=client)
+    if not result:
+        return None
+    result.setdefault('queue_wait', 0.0)
+    user = User.query.get(user_uuid) if user_uuid else None
+    if user:
+        log_command(user, command, challenge, result)
+        result['badges'] = sorted(command_log.badge_ids(user))
+    return result
+
+
 def get_ip(request_obj: Request) -> str:
     if 'X-Real-Ip' in request_obj.headers:
         remote_addr = request_obj.headers.get("X-Real-Ip")
@@ -34,5 +62,9 @@ def get_ip(request_obj: Request) -> str:
     return remote_addr
 
 
+def get_client(request_obj: Request) -> Client:
+    return Client(uuid=request_obj.headers.get('X-UUID'), ip=get_ip(request_obj))
+
+
 def get_user_agent(request_obj: Request) -> str:
     return request_obj.headers.get('User-Agent')
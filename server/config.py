@@ -18,11 +18,64 @@ class BaseConfig(object):
     SECRET_KEY = os.getenv("SECRET_KEY", "my_precious")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Asynchronous command execution
+    ASYNC_WORKERS = int(os.getenv("ASYNC_WORKERS", 4))
+    ASYNC_QUEUE_SIZE = int(os.getenv("ASYNC_QUEUE_SIZE", 64))
+    ASYNC_RESULT_TTL = int(os.getenv("ASYNC_RESULT_TTL", 300))
+
+    # Admission control for container executions. Every worker process has its own scheduler,
+    # so at most (number of workers) * SCHEDULER_MAX_CONCURRENT commands run at once
+    SCHEDULER_MAX_CONCURRENT = int(os.getenv("SCHEDULER_MAX_CONCURRENT", 4))
+    SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", 32))
+    SCHEDULER_MAX_PER_CLIENT = int(os.getenv("SCHEDULER_MAX_PER_CLIENT", 2))
+    # Many users may share an ip address, e.g. behind a NAT
+    SCHEDULER_MAX_PER_IP = int(os.getenv("SCHEDULER_MAX_PER_IP", 16))
+    SCHEDULER_QUEUE_TIMEOUT = float(os.getenv("SCHEDULER_QUEUE_TIMEOUT", 10))
+
+    # In-memory tier in front of the CommandCache table. A TTL of 0 disables expiration
+    COMMAND_CACHE_L1_SIZE = int(os.getenv("COMMAND_CACHE_L1_SIZE", 4096))
+    COMMAND_CACHE_L1_TTL = float(os.getenv("COMMAND_CACHE_L1_TTL", 3600))
+
+    # Eviction from the CommandCache table. A limit of 0 disables it. Ages are in seconds
+    COMMAND_CACHE_MAX_ROWS = int(os.getenv("COMMAND_CACHE_MAX_ROWS", 100000))
+    COMMAND_CACHE_MAX_BYTES = int(os.getenv("COMMAND_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+    COMMAND_CACHE_MAX_AGE = int(os.getenv("COMMAND_CACHE_MAX_AGE", 30 * 24 * 3600))
+    # rows that were hit less than MIN_HITS times within MIN_HITS_AGE seconds after they were stored
+    COMMAND_CACHE_MIN_HITS = int(os.getenv("COMMAND_CACHE_MIN_HITS", 1))
+    COMMAND_CACHE_MIN_HITS_AGE = int(os.getenv("COMMAND_CACHE_MIN_HITS_AGE", 7 * 24 * 3600))
+    # seconds between two background sweeps. 0 only sweeps with manage sweep-command-cache
+    COMMAND_CACHE_SWEEP_INTERVAL = float(os.getenv("COMMAND_CACHE_SWEEP_INTERVAL", 3600))
+    # outputs of at least that many bytes are stored compressed. 0 disables compression
+    COMMAND_CACHE_COMPRESS_MIN_SIZE = int(os.getenv("COMMAND_CACHE_COMPRESS_MIN_SIZE", 1024))
+
+    # Write-behind buffers flush every WRITE_BEHIND_INTERVAL seconds or once WRITE_BEHIND_BATCH_SIZE items are pending
+    WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", 0.5))
+    WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 100))
+    WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", 10000))
+    # A batch that could not be stored is retried with the next flush. Dropped after that many failures in a row
+    WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", 5))
+    # Buffer submitted commands in memory and store them in batches, instead of committing them while the user waits
+    COMMAND_LOG_WRITE_BEHIND = os.getenv("COMMAND_LOG_WRITE_BEHIND", "0") == "1"
+    # Number of (uuid, ip, user agent) triples per process that are known to be stored already
+    IDENTIFIER_SEEN_SIZE = int(os.getenv("IDENTIFIER_SEEN_SIZE", 65536))
+
+    # Seconds between two checks whether the in-memory challenges and badges must be reloaded
+    REGISTRY_CHECK_INTERVAL = float(os.getenv("REGISTRY_CHECK_INTERVAL", 5))
+    # max-age of the Cache-Control header of /challenge/list and /badges/list
+    LIST_CACHE_MAX_AGE = int(os.getenv("LIST_CACHE_MAX_AGE", 60))
+
+    # Fraction of requests whose pipeline stages are traced and logged
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.01))
+    # Return the stage durations of traced requests in the Server-Timing header
+    TRACE_RESPONSE_HEADER = os.getenv("TRACE_RESPONSE_HEADER", "0") == "1"
+
 
 class DevelopmentConfig(BaseConfig):
     """Development configuration."""
     FLASK_DEBUG = True
     DEBUG = True
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 1))
+    TRACE_RESPONSE_HEADER = True
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", "sqlite:///../test.db")
 
 
@@ -1,5 +1,48 @@
+import threading
+import typing
+from contextlib import contextmanager
+
+from sqlalchemy import inspect, and_, or_
+
 from server.extensions import db
 
+# unit of work nesting depth per thread
+_local = threading.local()
+
+BULK_CHUNK_SIZE = 500
+
+
+def in_unit_of_work() -> bool:
+    return getattr(_local, 'depth', 0) > 0
+
+
+@contextmanager
+def unit_of_work():
+    """
+    Group all create, save and delete calls inside the block into a single transaction.
+    It is committed once the outermost block ends and rolled back if an exception is raised.
+    Inside the block changes are only flushed, so that primary keys and constraint violations show up right away.
+    """
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield db.session
+        if _local.depth == 1:
+            db.session.commit()
+    except BaseException:
+        if _local.depth == 1:
+            db.session.rollback()
+        raise
+    finally:
+        _local.depth -= 1
+
+
+def commit() -> None:
+    """ Commit, unless a unit of work commits later """
+    if in_unit_of_work():
+        db.session.flush()
+    else:
+        db.session.commit()
+
 
 class CRUDMixin(object):
     def __repr__(self):
@@ -13,12 +56,55 @@ class CRUDMixin(object):
         instance = cls(**kwargs)
         return instance.save()
 
+    @classmethod
+    def bulk_create(cls, rows: typing.Iterable[dict]) -> int:
+        """
+        Insert many rows with a single statement per chunk and commit once. Returns the number of rows.
+        """
+        rows = list(rows)
+        for start in range(0, len(rows), BULK_CHUNK_SIZE):
+            db.session.bulk_insert_mappings(cls, rows[start:start + BULK_CHUNK_SIZE])
+        commit()
+        return len(rows)
+
+    @classmethod
+    def bulk_upsert(cls, rows: typing.Iterable[dict], keys: typing.Sequence[str] = None) -> typing.Tuple[int, int]:
+        """
+        Update the rows that already exist and insert the others. Commits once.
+        Rows are matched by keys, which default to the primary key. Returns the number of (inserted, updated) rows.
+        """
+        mapper = inspect(cls)
+        primary_keys = [column.key for column in mapper.primary_key]
+        keys = list(keys or primary_keys)
+        rows_by_key = {tuple(row[key] for key in keys): row for row in rows}
+
+        # primary keys of the existing rows, by their keys
+        existing: typing.Dict[tuple, dict] = {}
+        columns = [getattr(cls, key) for key in keys] + [getattr(cls, key) for key in primary_keys]
+        identities = list(rows_by_key)
+        for start in range(0, len(identities), BULK_CHUNK_SIZE):
+            criteria = [
+                and_(*(getattr(cls, key) == value for key, value in zip(keys, identity)))
+                for identity in identities[start:start + BULK_CHUNK_SIZE]
+            ]
+            for values in db.session.query(*columns).filter(or_(*criteria)):
+                existing[tuple(values[:len(keys)])] = dict(zip(primary_keys, values[len(keys):]))
+
+        inserts = [row for identity, row in rows_by_key.items() if identity not in existing]
+        updates = [dict(row, **existing[identity]) for identity, row in rows_by_key.items() if identity in existing]
+        for start in range(0, len(inserts), BULK_CHUNK_SIZE):
+            db.session.bulk_insert_mappings(cls, inserts[start:start + BULK_CHUNK_SIZE])
+        for start in range(0, len(updates), BULK_CHUNK_SIZE):
+            db.session.bulk_update_mappings(cls, updates[start:start + BULK_CHUNK_SIZE])
+        commit()
+        return len(inserts), len(updates)
+
     def save(self):
         """
         Saves the object to the database.
         """
         db.session.add(self)
-        db.session.commit()
+        commit()
         return self
 
     def delete(self):
@@ -26,5 +112,5 @@ class CRUDMixin(object):
         Delete the object from the database.
         """
         db.session.delete(self)
-        db.session.commit()
+        commit()
         return self
@@ -2,12 +2,27 @@ from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 
 from executor.run_cmd import CommandExecutor
+from server.coalesce import SingleFlight
+from server.jobs import JobQueue
+from server.lru import LRUCache
+from server.scheduler import FairScheduler, AdmissionRejected
 
 db = SQLAlchemy()
 cors = CORS()
 c = CommandExecutor()
+jobs = JobQueue()
+scheduler = FairScheduler()
+command_cache_l1 = LRUCache()
+# a rejected admission only concerns the client of the executing request
+coalescer = SingleFlight(private_errors=(AdmissionRejected,))
 
 
 def init_extensions(app):
     db.init_app(app)
     cors.init_app(app, resources={r"/*": {"origins": "*"}})
+    jobs.init_app(app)
+    scheduler.init_app(app)
+    command_cache_l1.configure(
+        maxsize=app.config.get('COMMAND_CACHE_L1_SIZE', 4096),
+        ttl=app.config.get('COMMAND_CACHE_L1_TTL') or None
+    )
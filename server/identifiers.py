@@ -0,0 +1,81 @@
+"""
+Tracking of the (IP address, user agent) pairs a user was seen with.
+
+Every page load of a returning user reports its identifier, but it hardly ever changes.
+Known (uuid, ip, user agent) triples are skipped through an in-memory seen-set.
+New sightings are written behind in batches, so that the request does not wait for a commit.
+"""
+import logging
+import typing
+
+from flask import Flask
+
+from server.extensions import db
+from server.lru import LRUCache
+from server.models import User, UserIdentifier
+from server.writebehind import WriteBehind
+
+logger = logging.getLogger(__name__)
+
+Sighting = typing.Tuple[str, str, str]
+
+
+def store_sightings(sightings: typing.List[Sighting]) -> None:
+    """ Link every user to its identifiers, creating missing identifiers. Commits once for the whole batch """
+    sightings = set(sightings)
+    identifiers: typing.Dict[typing.Tuple[str, str], UserIdentifier] = {}
+    for ip_addr, user_agent in {(ip_addr, user_agent) for _, ip_addr, user_agent in sightings}:
+        identifier = UserIdentifier.query.filter(
+            UserIdentifier.ip_addr == ip_addr,
+            UserIdentifier.user_agent == user_agent
+        ).first()
+        if not identifier:
+            identifier = UserIdentifier(ip_addr=ip_addr, user_agent=user_agent)
+            db.session.add(identifier)
+        identifiers[(ip_addr, user_agent)] = identifier
+
+    users = {user.uuid: user for user in User.query.filter(User.uuid.in_({uuid for uuid, _, _ in sightings}))}
+    for uuid, ip_addr, user_agent in sightings:
+        user = users.get(uuid)
+        identifier = identifiers[(ip_addr, user_agent)]
+        if user and identifier not in user.user_identifiers:
+            user.user_identifiers.append(identifier)
+    db.session.commit()
+
+
+class IdentifierTracker(object):
+    """
+    seen_size:  number of (uuid, ip, user agent) triples remembered per process
+    """
+
+    def __init__(self, seen_size: int = 65536):
+        self.seen = LRUCache(maxsize=seen_size)
+        self.buffer = WriteBehind(self._store, name="identifiers")
+
+    def init_app(self, app: Flask) -> None:
+        self.seen.configure(maxsize=app.config.get('IDENTIFIER_SEEN_SIZE', self.seen.maxsize))
+        self.buffer.init_app(app)
+
+    def track(self, user_uuid: str, ip_addr: str, user_agent: str) -> None:
+        """ Remember that the user was seen with that identifier. Returns immediately """
+        sighting = (user_uuid, ip_addr, user_agent)
+        if self.seen.get(sighting):
+            return
+        self.seen.set(sighting, True)
+        self.buffer.put(sighting)
+
+    def _store(self, sightings: typing.List[Sighting]) -> None:
+        try:
+            store_sightings(sightings)
+        except Exception:
+            db.session.rollback()
+            # forget them, so that the next sighting tries again
+            for sighting in sightings:
+                self.seen.pop(sighting)
+            raise
+
+    def stats(self) -> dict:
+        return dict(self.buffer.stats(), seen=len(self.seen))
+
+
+identifier_tracker = IdentifierTracker()
@@ -0,0 +1,167 @@
+"""
+Bounded in-process worker pool for asynchronous command execution.
+
+Submissions are handed to a small number of worker threads and a job id is returned right away.
+The client can then poll for the result, while the WSGI worker is free to serve other requests.
+The state and result of every job are stored in the database (table async_job), because the poll may be
+served by another worker process than the one executing the job.
+"""
+import datetime
+import json
+import logging
+import threading
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    """ Raised if there are already too many pending jobs """
+    pass
+
+
+class JobStatus(object):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class Job(object):
+    def __init__(self, job_id: str = None, status: str = JobStatus.QUEUED, result: typing.Optional[dict] = None,
+                 error: typing.Optional[str] = None):
+        self.id: str = job_id or str(uuid4())
+        self.status: str = status
+        self.result: typing.Optional[dict] = result
+        self.error: typing.Optional[str] = error
+
+    def __repr__(self):
+        return f"<Job {self.id}: {self.status}>"
+
+    @classmethod
+    def from_row(cls, row) -> "Job":
+        return cls(row.id, row.status, json.loads(row.result) if row.result else None, row.error)
+
+    @property
+    def pending(self) -> bool:
+        return self.status in (JobStatus.QUEUED, JobStatus.RUNNING)
+
+    def to_dict(self) -> dict:
+        return dict(
+            job_id=self.id,
+            status=self.status
+        )
+
+
+class JobQueue(object):
+    """
+    Runs functions inside an application context on a bounded pool of worker threads.
+    max_pending bounds the jobs of this process. Finished jobs are kept for result_ttl seconds,
+    so that clients can fetch their result from any worker process.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.workers: int = 4
+        self.max_pending: int = 64
+        self.result_ttl: int = 300
+        self._executor: typing.Optional[ThreadPoolExecutor] = None
+        self._pending: int = 0
+        self._submitted: int = 0
+        self._pruned: float = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('ASYNC_WORKERS', self.workers)
+        self.max_pending = app.config.get('ASYNC_QUEUE_SIZE', self.max_pending)
+        self.result_ttl = app.config.get('ASYNC_RESULT_TTL', self.result_ttl)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # threads are started lazily, so that forking WSGI servers do not copy them
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        return self._executor
+
+    def submit(self, func: typing.Callable, *args, **kwargs) -> Job:
+        # imported here, because server.extensions creates the queue
+        from server.models import AsyncJob
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f"There are already {self._pending} pending jobs")
+            self._pending += 1
+            self._submitted += 1
+        job = Job()
+        try:
+            # the deletion of expired jobs is committed together with the new job
+            self._prune()
+            AsyncJob.create(id=job.id, status=job.status)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        self.executor.submit(self._run, job, func, *args, **kwargs)
+        return job
+
+    def get(self, job_id: str) -> typing.Optional[Job]:
+        from server.models import AsyncJob
+
+        row = AsyncJob.query.get(job_id)
+        return Job.from_row(row) if row else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(pending=self._pending, submitted=self._submitted)
+
+    def _run(self, job: Job, func: typing.Callable, *args, **kwargs) -> None:
+        from server.extensions import db
+
+        try:
+            with self.app.app_context():
+                self._update(job, status=JobStatus.RUNNING)
+                try:
+                    job.result = func(*args, **kwargs)
+                    job.status = JobStatus.DONE
+                except Exception as error:
+                    logger.exception(f"{job} failed: {error}")
+                    db.session.rollback()
+                    job.error = str(error)
+                    job.status = JobStatus.FAILED
+                self._update(
+                    job,
+                    status=job.status,
+                    result=json.dumps(job.result) if job.result else None,
+                    error=job.error,
+                    finished=datetime.datetime.now()
+                )
+        except Exception as error:
+            logger.exception(f"Could not store the state of {job}: {error}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    @staticmethod
+    def _update(job: Job, **values) -> None:
+        from server.extensions import db
+        from server.models import AsyncJob
+
+        AsyncJob.query.filter_by(id=job.id).update(values, synchronize_session=False)
+        db.session.commit()
+
+    def _prune(self) -> None:
+        """ Delete finished jobs whose results are older than result_ttl. At most every tenth of result_ttl """
+        from server.models import AsyncJob
+
+        now = time.monotonic()
+        if now - self._pruned < self.result_ttl / 10:
+            return
+        self._pruned = now
+        threshold = datetime.datetime.now() - datetime.timedelta(seconds=self.result_ttl)
+        AsyncJob.query.filter(AsyncJob.finished < threshold).delete(synchronize_session=False)
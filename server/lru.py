@@ -0,0 +1,84 @@
+"""
+Small thread safe in-memory LRU cache with an optional time to live.
+"""
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    maxsize:  max number of entries. The least recently used entry is evicted once it is exceeded
+    ttl:      seconds after which an entry expires. None means entries never expire
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: typing.Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: typing.Dict[typing.Hashable, typing.Tuple[float, typing.Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.expirations: int = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def configure(self, maxsize: int, ttl: typing.Optional[float] = None) -> None:
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._evict()
+
+    def get(self, key: typing.Hashable, default=None):
+        with self._lock:
+            try:
+                stored_at, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: typing.Hashable, value) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            self._evict()
+
+    def pop(self, key: typing.Hashable, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                size=len(self._data),
+                maxsize=self.maxsize,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                expirations=self.expirations,
+            )
+
+    def _evict(self) -> None:
+        """ Caller must hold the lock """
+        while len(self._data) > max(self.maxsize, 0):
+            self._data.popitem(last=False)
+            self.evictions += 1
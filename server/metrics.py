@@ -0,0 +1,56 @@
+"""
+Server side metrics. Rendered together with the executor metrics by the /metrics endpoint.
+"""
+import time
+import typing
+
+from flask import Flask, request, g
+
+from executor.metrics import Counter, Histogram, CallbackGauge, label_items
+from server.extensions import c, jobs, scheduler, command_cache_l1, coalescer
+from server.cache_eviction import cache_sweeper
+from server.commandlog import command_log
+from server.identifiers import identifier_tracker
+
+REQUEST_LATENCY = Histogram("http_request_seconds", "Latency of HTTP requests by route")
+COMMAND_CACHE_LOOKUPS = Counter("command_cache_lookups_total", "Command cache lookups by tier (memory, database) and result (hit, miss)")
+
+
+def stats_gauge(name: str, documentation: str, stats: typing.Callable[[], typing.Optional[dict]], label: str) -> CallbackGauge:
+    """ Export every numeric value of a stats() dict as a sample of a single gauge """
+
+    def collect() -> dict:
+        return {
+            label_items(**{label: key}): value
+            for key, value in (stats() or {}).items()
+            if isinstance(value, (int, float))
+        }
+
+    return CallbackGauge(name, documentation, collect)
+
+
+stats_gauge("executor_pool", "Container pool statistics", c.pool_stats, "stat")
+stats_gauge("executor_lru_cache", "In-process lru_cache of the command executor", c.cache_stats, "stat")
+stats_gauge("command_cache_memory", "In-process command cache statistics", command_cache_l1.stats, "stat")
+stats_gauge("command_coalescer", "Coalesced command executions", coalescer.stats, "stat")
+stats_gauge("scheduler", "Admission control of command executions", scheduler.stats, "stat")
+stats_gauge("async_jobs", "Asynchronous command executions", jobs.stats, "stat")
+stats_gauge("command_cache_hits", "Write-behind recording of command cache hits", cache_sweeper.stats, "stat")
+stats_gauge("command_log", "Write-behind log of submitted commands", command_log.stats, "stat")
+stats_gauge("identifier_tracking", "Write-behind tracking of user identifiers", identifier_tracker.stats, "stat")
+
+
+def init_metrics(app: Flask) -> None:
+    """ Measure the latency of every request """
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_latency(response):
+        start = g.get('request_start')
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            REQUEST_LATENCY.observe(time.perf_counter() - start, route=route, method=request.method, status=response.status_code)
+        return response
@@ -0,0 +1,93 @@
+"""
+Minimal schema migrations for existing databases.
+
+db.create_all() only creates missing tables. Columns that were added to a model later are added here with ALTER TABLE,
+indexes that were declared later are created here as well.
+"""
+import logging
+import typing
+
+from sqlalchemy import inspect, select, func, and_, or_
+
+logger = logging.getLogger(__name__)
+
+
+def add_column_statement(dialect, table, column) -> str:
+    """ ALTER TABLE statement that adds column. Names are quoted if needed, e.g. user is reserved in PostgreSQL """
+    preparer = dialect.identifier_preparer
+    column_type = column.type.compile(dialect=dialect)
+    return f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {column_type}'
+
+
+def add_missing_columns(db) -> typing.List[str]:
+    """ Add all columns that are declared on the models but missing in the database. Returns the added columns """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            engine.execute(add_column_statement(engine.dialect, table, column))
+            added.append(f"{table.name}.{column.name}")
+            logger.info(f"Added column {table.name}.{column.name}")
+    return added
+
+
+def add_missing_indexes(db) -> typing.List[str]:
+    """ Create all indexes that are declared on the models but missing in the database. Returns the created indexes """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            index.create(bind=engine)
+            added.append(index.name)
+            logger.info(f"Created index {index.name}")
+    return added
+
+
+def backfill_user_counters(db, only_missing: bool = True) -> int:
+    """ Compute the denormalized counters of the users from their submissions. Returns the number of updated users """
+    users = db.metadata.tables['user']
+    commands = db.metadata.tables['submitted_command']
+    solved = db.metadata.tables['solved_challenges']
+
+    def count(table, *criteria):
+        return select([func.count()]).select_from(table).where(and_(*criteria)).as_scalar()
+
+    last_submission = select([func.max(commands.c.time_submitted)]).where(commands.c.user_uuid == users.c.uuid).as_scalar()
+    statement = users.update().values(
+        correct_count=count(commands, commands.c.user_uuid == users.c.uuid, commands.c.solved_challenge == True),
+        wrong_count=count(commands, commands.c.user_uuid == users.c.uuid, commands.c.solved_challenge == False),
+        solved_count=count(solved, solved.c.user_id == users.c.uuid),
+        last_seen=func.coalesce(last_submission, users.c.first_seen)
+    )
+    if only_missing:
+        statement = statement.where(or_(
+            users.c.correct_count == None,
+            users.c.wrong_count == None,
+            users.c.solved_count == None,
+            users.c.last_seen == None
+        ))
+    updated = db.engine.execute(statement).rowcount
+    logger.info(f"Backfilled the counters of {updated} users")
+    return updated
+
+
+def migrate(db) -> typing.List[str]:
+    db.create_all()
+    added = add_missing_columns(db)
+    added += add_missing_indexes(db)
+    backfill_user_counters(db)
+    return added
@@ -17,16 +17,19 @@ import datetime
 import logging
 import re
 import typing
+import zlib
+from collections import namedtuple
 from enum import Enum, IntEnum
 from random import choice
 from uuid import uuid4
 
-from sqlalchemy import inspect
+from sqlalchemy import inspect, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm.exc import FlushError
 
-from server.crud import CRUDMixin
+from server.crud import CRUDMixin, unit_of_work
 from server.extensions import db
+from server.lru import LRUCache
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +59,9 @@ class MotivationFeedback(IntEnum):
         return tbl[self]
 
 
+SOLVED_12_CHALLENGE = "12_find_all_env_files_with_secrets"
+
+
 class BadgeConditions(Enum):
     SOLVED_FIRST_CHALLENGE = "SOLVED_FIRST_CHALLENGE"
     CHAIN_3_TOGETHER = "CHAIN_3_TOGETHER"
@@ -63,20 +69,32 @@ class BadgeConditions(Enum):
     ALL_SOLVED = "ALL_SOLVED"
     SOLVED_12 = "SOLVED_12"
 
-    def is_solved(self, user, cmd: str) -> bool:
+    def is_solved(self, user, cmd: str, solved_challenge: str = None, challenge_count: int = None) -> bool:
+        """
+        Evaluated after every submission against the counters and solved challenges of the user.
+        solved_challenge is the challenge the submission solved (if any), challenge_count the total number of challenges.
+        """
         tbl = {
-            'SOLVED_FIRST_CHALLENGE': user.correct_command_count > 0,
-            'CHAIN_3_TOGETHER': len(re.split(r"[&;>|]", cmd)) >= 3,
-            'WRONG_10_TIMES': user.wrong_command_count >= 10,
-            'ALL_SOLVED': len(user.solved_challenges) == Challenge.query.count(),
-            'SOLVED_12': "12_find_all_env_files_with_secrets" in map(lambda c: c.solved_challenge.identifier, user.solved_challenges)
+            'SOLVED_FIRST_CHALLENGE': lambda: user.correct_command_count > 0,
+            'CHAIN_3_TOGETHER': lambda: len(re.split(r"[&;>|]", cmd)) >= 3,
+            'WRONG_10_TIMES': lambda: user.wrong_command_count >= 10,
+            'ALL_SOLVED': lambda: challenge_count is not None and user.solved_challenge_count >= challenge_count,
+            'SOLVED_12': lambda: solved_challenge == SOLVED_12_CHALLENGE or user.has_solved(SOLVED_12_CHALLENGE)
         }
-        return tbl.get(self.value)
+        condition = tbl.get(self.value)
+        return bool(condition and condition())
+
+
+# Everything needed to evaluate the badge conditions, cached for ttl seconds (see Badge.rules)
+BadgeRules = namedtuple("BadgeRules", ["badges", "challenge_count"])
+badge_rule_cache = LRUCache(maxsize=1, ttl=60)
 
 
 badges_user_association_table = db.Table('badges_user_association_table',
                                          db.Column('user_id', db.String(255), db.ForeignKey('user.uuid')),
-                                         db.Column('badge_id', db.Integer, db.ForeignKey('badge.id'))
+                                         db.Column('badge_id', db.Integer, db.ForeignKey('badge.id')),
+                                         # user.badges is loaded on every submission and state request
+                                         db.Index('ix_badges_user_association_table_user_id', 'user_id')
                                          )
 
 
@@ -91,12 +109,17 @@ class SolvedChallenges(db.Model):
 
 user_identifier_association = db.Table('user_identifier_association',
                                        db.Column('user_identifier', db.Integer, db.ForeignKey('user_identifier.id')),
-                                       db.Column('user_id', db.String(255), db.ForeignKey('user.uuid'))
+                                       db.Column('user_id', db.String(255), db.ForeignKey('user.uuid')),
+                                       db.Index('ix_user_identifier_association_user_id', 'user_id')
                                        )
 
 
 class UserIdentifier(db.Model, CRUDMixin):
     __tablename__ = "user_identifier"
+    __table_args__ = (
+        # MySQL can only index a prefix of long strings
+        db.Index('ix_user_identifier_ip_addr_user_agent', 'ip_addr', 'user_agent', mysql_length={'user_agent': 255}),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     ip_addr = db.Column(db.String(255), unique=False)
@@ -122,6 +145,12 @@ class User(db.Model, CRUDMixin):
     english_skills = db.Column(db.String(255))
     bash_experience = db.Column(db.String(255))
 
+    # Denormalized counters, maintained by add_command. NULL for users that were not backfilled yet (see recount)
+    correct_count = db.Column(db.Integer, default=0)
+    wrong_count = db.Column(db.Integer, default=0)
+    solved_count = db.Column(db.Integer, default=0)
+    last_seen = db.Column(db.DateTime, default=datetime.datetime.now)
+
     # Relations
     user_identifiers = relationship(
         "UserIdentifier",
@@ -142,19 +171,38 @@ class User(db.Model, CRUDMixin):
         return f"<User: {self.uuid}>"
 
     @property
-    def correct_command_count(self):
-        return SubmittedCommand.query.filter(SubmittedCommand.user_uuid == self.uuid, SubmittedCommand.solved_challenge == True).count()
+    def correct_command_count(self) -> int:
+        if self.correct_count is None:
+            self.recount()
+        return self.correct_count
 
     @property
-    def wrong_command_count(self):
-        return SubmittedCommand.query.filter(SubmittedCommand.user_uuid == self.uuid, SubmittedCommand.solved_challenge == False).count()
+    def wrong_command_count(self) -> int:
+        if self.wrong_count is None:
+            self.recount()
+        return self.wrong_count
 
     @property
-    def last_seen(self):
-        try:
-            return SubmittedCommand.query.filter(SubmittedCommand.user_uuid == self.uuid).order_by(SubmittedCommand.time_submitted.desc()).first().time_submitted
-        except AttributeError:
-            return self.first_seen
+    def solved_challenge_count(self) -> int:
+        if self.solved_count is None:
+            self.recount()
+        return self.solved_count
+
+    def has_solved(self, challenge_identifier: str) -> bool:
+        return self.solved_challenge_count > 0 and SolvedChallenges.query.get((self.uuid, challenge_identifier)) is not None
+
+    @property
+    def badge_ids(self) -> typing.Set[int]:
+        return {badge.id for badge in self.badges}
+
+    def recount(self) -> None:
+        """ Recompute the denormalized counters from the submitted commands and solved challenges """
+        commands = SubmittedCommand.query.filter(SubmittedCommand.user_uuid == self.uuid)
+        self.correct_count = commands.filter(SubmittedCommand.solved_challenge == True).count()
+        self.wrong_count = commands.filter(SubmittedCommand.solved_challenge == False).count()
+        self.solved_count = SolvedChallenges.query.filter(SolvedChallenges.user_id == self.uuid).count()
+        last_submission = db.session.query(func.max(SubmittedCommand.time_submitted)).filter(SubmittedCommand.user_uuid == self.uuid).scalar()
+        self.last_seen = last_submission or self.first_seen
 
     @classmethod
     def create_user(cls):
@@ -163,28 +211,6 @@ class User(db.Model, CRUDMixin):
             mode=choice(list(GameModes))
         )
 
-    def set_identifier(self, ip_addr: str, user_agent: str):
-        # does it exist?
-        identifier = UserIdentifier.query.filter(
-            UserIdentifier.ip_addr == ip_addr,
-            UserIdentifier.user_agent == user_agent
-        ).first()
-
-        if identifier:
-            if identifier not in self.user_identifiers:
-                # update list of user agent of user if the current identifier is not associated with user
-                self.user_identifiers.append(identifier)
-        else:
-            # user agent does not exist -> Create it and link to user
-            self.user_identifiers.append(
-                UserIdentifier.create(
-                    ip_addr=ip_addr,
-                    user_agent=user_agent
-                )
-            )
-        # finally commit changes
-        self.save()
-
     def add_new_badges(self, applicable_badges: typing.Set):
         new_badges = applicable_badges - set(self.badges)
         if new_badges:
@@ -196,19 +222,33 @@ class User(db.Model, CRUDMixin):
         return dict(
             uuid=self.uuid,
             first_seen=self.first_seen,
-            last_seen=self.last_seen,
+            last_seen=self.last_seen or self.first_seen,
             mode=self.mode.value
         )
 
     def add_solved_challenge(self, challenge):
+        if SolvedChallenges.query.get((self.uuid, challenge.identifier)):
+            return
         try:
             a = SolvedChallenges(challenge_id=challenge.identifier)
             self.solved_challenges.append(a)
+            self.solved_count = User.solved_count + 1
             self.save()
         except FlushError:
+            # solved concurrently by another request of the same user
             pass
 
     def add_command(self, command_string: str, challenge_id: str, solved: bool):
+        if self.correct_count is None:
+            self.recount()
+            self.save()
+        # increment in SQL, so that concurrent submissions of the same user don't overwrite each other
+        if solved:
+            self.correct_count = User.correct_count + 1
+        else:
+            self.wrong_count = User.wrong_count + 1
+        self.last_seen = datetime.datetime.now()
+        # also saves the updated counters
         SubmittedCommand.create(command_string=command_string, challenge_id=challenge_id, solved_challenge=solved, user=self)
         if solved:
             challenge = Challenge.query.get(challenge_id)
@@ -217,6 +257,11 @@ class User(db.Model, CRUDMixin):
 
 class SubmittedCommand(db.Model, CRUDMixin):
     __tablename__ = "submitted_command"
+    __table_args__ = (
+        # both also serve lookups by user_uuid alone
+        db.Index('ix_submitted_command_user_uuid_solved_challenge', 'user_uuid', 'solved_challenge'),
+        db.Index('ix_submitted_command_user_uuid_time_submitted', 'user_uuid', 'time_submitted'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     time_submitted = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
@@ -299,8 +344,46 @@ class Badge(db.Model, CRUDMixin):
         return dict(list(map(lambda badge: (badge.name, badge.to_dict()), cls.query.all())))
 
     @classmethod
-    def earned_through_action(cls, user: User, command: str) -> typing.Set:
-        return {badge for badge in cls.active_badges() if badge.condition.is_solved(user, command)}
+    def rules(cls) -> BadgeRules:
+        """ (id, condition) of every active badge and the number of challenges. Cached, because they rarely change """
+        rules = badge_rule_cache.get('rules')
+        if rules is None:
+            rules = BadgeRules(
+                badges=[(badge.id, badge.condition) for badge in cls.active_badges()],
+                challenge_count=Challenge.query.count()
+            )
+            badge_rule_cache.set('rules', rules)
+        return rules
+
+    @classmethod
+    def clear_rules(cls) -> None:
+        badge_rule_cache.clear()
+
+    @classmethod
+    def earned_through_action(cls, user: User, command: str, solved_challenge: str = None) -> typing.Set:
+        """ Badges the user earned with this submission. Badges the user already owns are not evaluated again """
+        rules = cls.rules()
+        owned = user.badge_ids
+        earned = [
+            badge_id for badge_id, condition in rules.badges
+            if badge_id not in owned and condition.is_solved(user, command, solved_challenge, rules.challenge_count)
+        ]
+        return {cls.query.get(badge_id) for badge_id in earned}
+
+    @classmethod
+    def backfill(cls) -> int:
+        """
+        Award the badges that users in BADGE mode earned without getting them, e.g. before the badge existed.
+        Conditions on the submitted command can't be evaluated afterwards. Returns the number of awarded badges
+        """
+        awarded = 0
+        with unit_of_work():
+            for user in User.query.filter(User.mode == GameModes.BADGE).all():
+                earned = cls.earned_through_action(user, "")
+                user.add_new_badges(earned)
+                awarded += len(earned)
+        logger.info(f"Awarded {awarded} badges")
+        return awarded
 
 
 class FinalFeedback(db.Model, CRUDMixin):
@@ -312,15 +395,60 @@ class FinalFeedback(db.Model, CRUDMixin):
     user = relationship("User", back_populates="feedback")
 
 
+class AsyncJob(db.Model, CRUDMixin):
+    """ State and result of an asynchronous command execution, shared by all worker processes """
+    __tablename__ = "async_job"
+
+    id = db.Column(db.String(36), primary_key=True)
+    status = db.Column(db.String(16), nullable=False)
+    # JSON encoded result of the execution
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
+    finished = db.Column(db.DateTime, nullable=True, index=True)
+
+    def __repr__(self):
+        return f"<AsyncJob {self.id}: {self.status}>"
+
+
 class CommandCache(db.Model, CRUDMixin):
     __tablename__ = "command_cache"
+    __table_args__ = (
+        # purging the entries of outdated challenge versions
+        db.Index('ix_command_cache_challenge_identifier_challenge_version', 'challenge_identifier', 'challenge_version'),
+    )
 
     hash = db.Column(db.String(255), primary_key=True)
     challenge_identifier = db.Column(db.String(64), primary_key=True)
+    challenge_version = db.Column(db.String(64), nullable=True)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
 
     cmd_correct = db.Column(db.Boolean, default=False, nullable=False)
     cmd_output = db.Column(db.Text)
+    # large outputs are stored zlib compressed here instead of in cmd_output
+    cmd_output_compressed = db.Column(db.LargeBinary, nullable=True)
+    output_size = db.Column(db.Integer, nullable=True)
+
+    # usage, for the eviction of rarely used rows. Updated in batches, see server.cache_eviction
+    hits = db.Column(db.Integer, default=0)
+    last_access = db.Column(db.DateTime, nullable=True, default=datetime.datetime.now)
+
+    @property
+    def output(self) -> typing.Optional[str]:
+        if self.cmd_output_compressed is not None:
+            return zlib.decompress(self.cmd_output_compressed).decode('utf-8')
+        return self.cmd_output
+
+    def set_output(self, output: typing.Optional[str], compress_min_size: int = 1024) -> None:
+        """ Store the output, compressed if it is at least compress_min_size bytes long. 0 disables compression """
+        encoded = (output or "").encode('utf-8')
+        self.output_size = len(encoded)
+        if compress_min_size and len(encoded) >= compress_min_size:
+            self.cmd_output = None
+            self.cmd_output_compressed = zlib.compress(encoded)
+        else:
+            self.cmd_output = output
+            self.cmd_output_compressed = None
 
     @classmethod
     def get_by_pks(cls, **kwargs):
@@ -1,6 +1,7 @@
 import typing
 
-from server.models import Challenge
+from executor.decorators import trace_stage
+from server.registry import challenge_registry
 
 
 def get_command_from_json(body: dict) -> str:
@@ -11,10 +12,23 @@ def get_challenge_from_json(body: dict) -> str:
     return body["challenge"]
 
 
+def is_async_request(body: dict) -> bool:
+    return bool(body.get("async", False))
+
+
 def split_command(command_string: str) -> typing.List[str]:
     return command_string.split()
 
 
+def normalize_command(command_string: str) -> str:
+    """
+    Canonical form of a command.
+    The runner joins the split command with single spaces before handing it to bash,
+    so commands that only differ in whitespace are executed identically.
+    """
+    return " ".join(split_command(command_string))
+
+
 def is_valid_request_body(body: dict) -> typing.Tuple[bool, str]:
     """
     Expected data looks like: {"command": "ls -a", "challenge":"challenge_id"}
@@ -32,10 +46,12 @@ def is_valid_request_body(body: dict) -> typing.Tuple[bool, str]:
     return error, error_msg
 
 
+@trace_stage("validate_challenge")
 def is_valid_challenge_identifier(challenge_id: str) -> bool:
-    return challenge_id in map(lambda x: x.identifier, Challenge.query.all())
+    return isinstance(challenge_id, str) and challenge_id in challenge_registry
 
 
+@trace_stage("parse_request")
 def parse_request(json_body: dict) -> [str, str]:
     command = get_command_from_json(json_body)
     challenge = get_challenge_from_json(json_body)
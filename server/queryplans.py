@@ -0,0 +1,87 @@
+"""
+Recording and explaining the SQL statements a piece of code issues.
+
+Used by the tests of the routes (tests/test_queries.py) to assert the number of statements and commits per request
+and to catch missing indexes, i.e. statements that scan a whole table.
+"""
+import re
+import threading
+import typing
+
+from sqlalchemy import event
+
+# Tiny tables, that are read as a whole on purpose and cached in memory afterwards (see server.registry, Badge.rules)
+SMALL_TABLES = ("challenge", "badge")
+
+# statements whose plan is of interest
+EXPLAINABLE = re.compile(r"^\s*(SELECT|UPDATE|DELETE)\b", re.IGNORECASE)
+
+
+class StatementRecorder(object):
+    """ Records the statements and commits the current thread issues while the recorder is active """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements: typing.List[typing.Tuple[str, typing.Any]] = []
+        self.commits: int = 0
+        self._thread: typing.Optional[int] = None
+
+    def __enter__(self):
+        self._thread = threading.get_ident()
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        event.listen(self.engine, "commit", self._commit)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+        event.remove(self.engine, "commit", self._commit)
+
+    def _record(self, connection, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self._thread:
+            self.statements.append((statement, parameters[0] if executemany and parameters else parameters))
+
+    def _commit(self, connection):
+        if threading.get_ident() == self._thread:
+            self.commits += 1
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def full_scans(self) -> typing.List[typing.Tuple[str, str]]:
+        """ (table, statement) of every recorded statement that reads a whole table """
+        scans = []
+        for statement, parameters in self.statements:
+            if not EXPLAINABLE.match(statement):
+                continue
+            for table in scanned_tables(self.engine, explain(self.engine, statement, parameters)):
+                if table not in SMALL_TABLES:
+                    scans.append((table, statement))
+        return scans
+
+
+def explain(engine, statement: str, parameters=()) -> typing.List[str]:
+    """ The plan of the statement as lines of text """
+    prefix = "EXPLAIN QUERY PLAN" if engine.dialect.name == "sqlite" else "EXPLAIN"
+    rows = engine.execute(f"{prefix} {statement}", parameters).fetchall()
+    if engine.dialect.name == "sqlite":
+        # (id, parent, notused, detail)
+        return [row[-1] for row in rows]
+    return [" ".join(str(value) for value in row) for row in rows]
+
+
+def scanned_tables(engine, plan: typing.List[str]) -> typing.List[str]:
+    """ The tables the plan reads as a whole instead of using an index """
+    dialect = engine.dialect.name
+    tables = []
+    for line in plan:
+        if dialect == "sqlite":
+            # e.g. "SCAN user" or "SCAN TABLE user" (older versions), but not "SCAN user USING INDEX ..."
+            match = re.match(r"SCAN (?:TABLE )?(\w+)(?: AS \w+)?$", line)
+            if match:
+                tables.append(match.group(1))
+        elif dialect == "postgresql":
+            match = re.search(r"Seq Scan on (\w+)", line)
+            if match:
+                tables.append(match.group(1))
+    return tables
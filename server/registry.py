@@ -0,0 +1,146 @@
+"""
+Process level registries of the challenges and badges.
+
+Checking a challenge identifier and listing the challenges and badges are the most frequent lookups of the server.
+Instead of querying the tables for each of them, the registries keep the rows in memory
+together with the serialized (and compressed) /challenge/list and /badges/list payloads.
+A registry is reloaded once its data changed, e.g. after manage load-challenges or load-badges ran in another process.
+Changes are detected by the content hash of the rows. Row counts or file timestamps miss updates of existing rows.
+"""
+import gzip
+import hashlib
+import io
+import logging
+import threading
+import time
+import typing
+
+from flask import Flask, json
+from sqlalchemy.exc import SQLAlchemyError
+
+from server.models import Challenge, Badge
+
+logger = logging.getLogger(__name__)
+
+
+def compress(data: bytes) -> bytes:
+    """ Gzip data. mtime=0 keeps the compressed bytes identical across processes """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=9, mtime=0) as gzip_fd:
+        gzip_fd.write(data)
+    return buffer.getvalue()
+
+
+class Payload(object):
+    """ JSON response body that is serialized and compressed once and identified by a strong ETag """
+
+    def __init__(self, data):
+        self.body: bytes = json.dumps(data).encode('utf-8')
+        self.gzipped: bytes = compress(self.body)
+        self.etag: str = hashlib.sha256(self.body).hexdigest()[:32]
+
+    def __repr__(self):
+        return f"<Payload {self.etag} {len(self.body)} bytes ({len(self.gzipped)} gzipped)>"
+
+
+class Registry(object):
+    """
+    Base class for in-memory copies of rarely changing tables.
+    Every check loads the (small) tables and swaps the copy if the hash of their content changed.
+
+    check_interval:  seconds between two checks whether the data needs to be reloaded
+    """
+    name = "rows"
+
+    def __init__(self, check_interval: float = 5.0):
+        self.check_interval = check_interval
+        self.payload: Payload = Payload({})
+        self._items: typing.Dict[typing.Hashable, dict] = {}
+        self._loaded: bool = False
+        self._checked: float = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Flask) -> None:
+        self.check_interval = app.config.get('REGISTRY_CHECK_INTERVAL', self.check_interval)
+        with app.app_context():
+            try:
+                self.reload()
+            except SQLAlchemyError as error:
+                # e.g. the tables were not created yet. The next lookup tries again
+                logger.warning(f"Could not load the {self.name}: {error}")
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        self.refresh()
+        return key in self._items
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self._items)
+
+    def get(self, key: typing.Hashable) -> typing.Optional[dict]:
+        self.refresh()
+        return self._items.get(key)
+
+    @property
+    def list_payload(self) -> Payload:
+        """ All items as a single JSON object """
+        self.refresh()
+        return self.payload
+
+    def load(self) -> typing.Dict[typing.Hashable, dict]:
+        raise NotImplementedError
+
+    def refresh(self) -> None:
+        """ Reload the data if it changed. Checks at most every check_interval seconds """
+        now = time.monotonic()
+        if self._loaded and now - self._checked < self.check_interval:
+            return
+        with self._lock:
+            if self._loaded and now - self._checked < self.check_interval:
+                return
+            self._checked = now
+            self._reload()
+
+    def reload(self) -> None:
+        with self._lock:
+            self._checked = time.monotonic()
+            self._reload()
+
+    def _reload(self) -> None:
+        items = self.load()
+        payload = Payload(items)
+        self._loaded = True
+        if payload.etag == self.payload.etag:
+            return
+        self.payload = payload
+        self._items = items
+        self.on_change()
+        logger.info(f"Loaded {len(items)} {self.name}")
+
+    def on_change(self) -> None:
+        """ Called after the content changed """
+        pass
+
+
+class ChallengeRegistry(Registry):
+    """ Reloaded when any challenge inside the database changes """
+    name = "challenges"
+
+    def load(self) -> typing.Dict[str, dict]:
+        return Challenge.json_list()
+
+
+class BadgeRegistry(Registry):
+    """ Reloaded when any badge inside the database changes """
+    name = "badges"
+
+    def load(self) -> typing.Dict[str, dict]:
+        return Badge.json_list()
+
+    def on_change(self) -> None:
+        # the cached badge rules of this process are stale as well
+        Badge.clear_rules()
+
+
+challenge_registry = ChallengeRegistry()
+badge_registry = BadgeRegistry()
@@ -1,50 +1,95 @@
 import logging
 
-from flask import Blueprint, request, jsonify, abort
+from flask import Blueprint, request, jsonify, abort, Response, current_app
 from sqlalchemy.exc import StatementError
 
-from server.challenges import execute_command
-from server.common import get_user, log_command, get_ip, get_user_agent
-from server.extensions import db
+from executor.metrics import REGISTRY
+from executor.tracing import stage
+
+from server.commandlog import command_log
+from server.common import get_user, get_ip, get_user_agent, run_submission, get_client
+from server.crud import unit_of_work
+from server.extensions import db, jobs
+from server.jobs import JobQueueFull
+from server.scheduler import AdmissionRejected
 from server.forms import DemographyForm
-from server.models import User, Badge, Challenge, FinalFeedback
-from server.parse import is_valid_request_body, parse_request
+from server.identifiers import identifier_tracker
+from server.models import User, FinalFeedback
+from server.parse import is_valid_request_body, parse_request, is_async_request
+from server.registry import challenge_registry, badge_registry, Payload
 
 routes = Blueprint("manage", __name__)
 logger = logging.getLogger(__name__)
 
 
+def payload_response(payload: Payload) -> Response:
+    """ Serve a pre-serialized payload. Gzipped if the client accepts it and 304 if the client's copy is still valid """
+    compressed = request.accept_encodings['gzip'] > 0
+    etag = f"{payload.etag}-gzip" if compressed else payload.etag
+    headers = {
+        'Cache-Control': f"public, max-age={current_app.config.get('LIST_CACHE_MAX_AGE', 60)}",
+        'Vary': 'Accept-Encoding',
+    }
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+    elif compressed:
+        response = Response(payload.gzipped, mimetype="application/json", headers=dict(headers, **{'Content-Encoding': 'gzip'}))
+    else:
+        response = Response(payload.body, mimetype="application/json", headers=headers)
+    response.set_etag(etag)
+    return response
+
+
 @routes.route('/command/run', methods=['GET', 'POST'])
 def run_command():
     json_body = request.get_json(silent=True)
     error, error_msg = is_valid_request_body(json_body)
     if not error:
         command, challenge = parse_request(json_body)
-        result: dict = execute_command(command, challenge)
+        user_uuid = request.headers.get('X-UUID')
+        client = get_client(request)
+        if is_async_request(json_body):
+            try:
+                job = jobs.submit(run_submission, command, challenge, user_uuid, client)
+            except JobQueueFull:
+                return jsonify(dict(success=False, error="Too many pending commands. Try again later.")), 503
+            return jsonify(job.to_dict()), 202
+
+        try:
+            result: dict = run_submission(command, challenge, user_uuid, client)
+        except AdmissionRejected as error:
+            return jsonify(dict(success=False, error="Too many commands. Try again later.")), error.status_code, {'Retry-After': 1}
         if not result:
             return jsonify(dict(success=False, error="Could not execute!")), 400
-        user = get_user(request.headers)
-        if user:
-            log_command(user, command, challenge, result)
-            result['badges'] = [badge.id for badge in user.badges]
 
-        return jsonify(result), 200
+        with stage("response"):
+            return jsonify(result), 200
 
     return jsonify(dict(success=False, error=error_msg)), 400
 
 
+@routes.route('/command/result/<string:job_id>', methods=['GET'])
+def get_command_result(job_id: str):
+    job = jobs.get(job_id)
+    if not job:
+        abort(404)
+    if job.pending:
+        return jsonify(job.to_dict()), 202
+    if not job.result:
+        return jsonify(dict(success=False, error=job.error or "Could not execute!", **job.to_dict())), 400
+    return jsonify(dict(job.result, **job.to_dict())), 200
+
+
 @routes.route('/session/new', methods=['POST'])
 def new_session():
     """ The user only gets a UUID, if he or she submits the survey """
     form = DemographyForm()
     if form.validate_on_submit():
-        user = User.create_user()
-        form.populate_user(user)
-        user.save()
-        user.set_identifier(
-            ip_addr=get_ip(request),
-            user_agent=get_user_agent(request)
-        )
+        with unit_of_work():
+            user = User.create_user()
+            form.populate_user(user)
+            user.save()
+        identifier_tracker.track(user.uuid, get_ip(request), get_user_agent(request))
         return jsonify(user.to_dict()), 201
     # send errors
     errors = form.get_errors()
@@ -53,14 +98,18 @@ def new_session():
 
 @routes.route('/challenge/list', methods=['GET'])
 def list_challenges():
-    challenges = Challenge.json_list()
-    return jsonify(challenges), 200
+    return payload_response(challenge_registry.list_payload)
+
+
+@routes.route('/metrics', methods=['GET'])
+def metrics():
+    """ Metrics of this worker process in the Prometheus text format """
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 
 @routes.route('/badges/list', methods=['GET'])
 def list_badges():
-    badges = Badge.json_list()
-    return jsonify(badges), 200
+    return payload_response(badge_registry.list_payload)
 
 
 @routes.route('/user/<string:uuid>/state', methods=['GET'])
@@ -71,14 +120,11 @@ def get_user_state(uuid: str):
         abort(404)
     else:
         # user exists and has been seen yet update user identifiers
-        user.set_identifier(
-            ip_addr=get_ip(request),
-            user_agent=get_user_agent(request)
-        )
+        identifier_tracker.track(user.uuid, get_ip(request), get_user_agent(request))
     state = dict(
-        badges=[badge.id for badge in user.badges],
+        badges=sorted(command_log.badge_ids(user)),
         mode=user.mode.value,
-        solved_challenges=[challenge.solved_challenge.identifier for challenge in user.solved_challenges]
+        solved_challenges=command_log.solved_challenges(user)
     )
     return jsonify(state), 200
 
@@ -101,7 +147,8 @@ def submit_feedback():
         feedback = json_body['feedback']
         if not isinstance(feedback, int):
             feedback = int(feedback)
-        user.feedback.append(FinalFeedback.create(motivation=feedback))
+        with unit_of_work():
+            user.feedback.append(FinalFeedback.create(motivation=feedback))
     except (KeyError, IndexError, ValueError):
         return jsonify(dict(error="Invalid Feedback")), 400
     except StatementError:
@@ -0,0 +1,184 @@
+"""
+Admission control and fair scheduling for container executions.
+
+Only a limited number of commands are executed at once. Everything above that limit is queued.
+Queued commands are dispatched round robin per client (the user's X-UUID or, if unknown, the remote address),
+so that a single user hammering "run" can not starve everyone else.
+Requests are rejected right away if a user or an ip address has too many outstanding commands (429) or the queue is full (503).
+The ip limit is much higher than the user limit, because many users may share an address, e.g. behind a NAT.
+
+Every worker process has its own scheduler. So the global cap of a deployment is
+(number of worker processes) * max_concurrent and the per user and per ip limits apply per process as well.
+"""
+import logging
+import threading
+import time
+import typing
+from collections import OrderedDict, Counter, deque, namedtuple
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """ Base class for rejected executions. Carries the HTTP status code that should be returned """
+    status_code = 503
+
+
+class QueueFull(AdmissionRejected):
+    status_code = 503
+
+
+class TooManyRequests(AdmissionRejected):
+    status_code = 429
+
+
+class Client(namedtuple('Client', ['uuid', 'ip'])):
+    """ Identifies who submitted a command """
+
+    @property
+    def key(self) -> typing.Optional[str]:
+        return self.uuid or self.ip
+
+    @property
+    def limit_keys(self) -> typing.List[tuple]:
+        return [(kind, value) for kind, value in (('uuid', self.uuid), ('ip', self.ip)) if value]
+
+
+ANONYMOUS = Client(uuid=None, ip=None)
+
+
+class Ticket(object):
+    def __init__(self, client: Client):
+        self.client: Client = client
+        self.enqueued: float = time.monotonic()
+        self.granted: bool = False
+        self.wait_time: float = 0.0
+
+    def grant(self) -> None:
+        self.granted = True
+        self.wait_time = time.monotonic() - self.enqueued
+
+
+class FairScheduler(object):
+    """
+    max_concurrent:   cap of concurrently running executions of this process
+    max_queue:        max number of queued executions
+    max_per_client:   max number of outstanding (queued + running) executions per user
+    max_per_ip:       max number of outstanding (queued + running) executions per ip address
+    queue_timeout:    seconds a queued execution waits at most before it is rejected
+    """
+
+    def __init__(self, app=None):
+        self.max_concurrent: int = 4
+        self.max_queue: int = 32
+        self.max_per_client: int = 2
+        self.max_per_ip: int = 16
+        self.queue_timeout: float = 10.0
+
+        self._active: int = 0
+        self._queued: int = 0
+        self._waiting: typing.Dict[str, typing.Deque[Ticket]] = OrderedDict()
+        self._outstanding: typing.Counter = Counter()
+        self._rejected: typing.Counter = Counter()
+        self._lock = threading.Condition()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_concurrent = app.config.get('SCHEDULER_MAX_CONCURRENT', self.max_concurrent)
+        self.max_queue = app.config.get('SCHEDULER_MAX_QUEUE', self.max_queue)
+        self.max_per_client = app.config.get('SCHEDULER_MAX_PER_CLIENT', self.max_per_client)
+        self.max_per_ip = app.config.get('SCHEDULER_MAX_PER_IP', self.max_per_ip)
+        self.queue_timeout = app.config.get('SCHEDULER_QUEUE_TIMEOUT', self.queue_timeout)
+
+    @contextmanager
+    def admit(self, client: Client = None) -> typing.Iterator[Ticket]:
+        """ Block until the client may execute. Raises an AdmissionRejected error if it may not """
+        ticket = self._enqueue(client or ANONYMOUS)
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                active=self._active,
+                queued=self._queued,
+                rejected_queue_full=self._rejected[QueueFull],
+                rejected_too_many_requests=self._rejected[TooManyRequests],
+            )
+
+    def _limit(self, key: tuple) -> int:
+        kind, _ = key
+        return self.max_per_ip if kind == 'ip' else self.max_per_client
+
+    def _reject(self, error: AdmissionRejected) -> typing.NoReturn:
+        self._rejected[type(error)] += 1
+        logger.warning(f"Rejected execution: {error}")
+        raise error
+
+    def _enqueue(self, client: Client) -> Ticket:
+        ticket = Ticket(client)
+        with self._lock:
+            if any(self._outstanding[key] >= self._limit(key) for key in client.limit_keys):
+                self._reject(TooManyRequests(f"{client} has too many outstanding commands"))
+
+            if self._active < self.max_concurrent and not self._waiting:
+                ticket.grant()
+                self._active += 1
+            elif self._queued >= self.max_queue:
+                self._reject(QueueFull(f"Queue is full ({self._queued} commands)"))
+            else:
+                self._waiting.setdefault(client.key, deque()).append(ticket)
+                self._queued += 1
+
+            for key in client.limit_keys:
+                self._outstanding[key] += 1
+
+            deadline = ticket.enqueued + self.queue_timeout
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._withdraw(ticket)
+                    self._reject(QueueFull(f"{client} waited more than {self.queue_timeout}s"))
+                self._lock.wait(remaining)
+        return ticket
+
+    def _withdraw(self, ticket: Ticket) -> None:
+        """ Remove a ticket, that is still waiting, from the queue. Caller must hold the lock """
+        queue = self._waiting.get(ticket.client.key)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            self._queued -= 1
+            if not queue:
+                del self._waiting[ticket.client.key]
+        self._forget(ticket)
+
+    def _forget(self, ticket: Ticket) -> None:
+        for key in ticket.client.limit_keys:
+            self._outstanding[key] -= 1
+            if self._outstanding[key] <= 0:
+                del self._outstanding[key]
+
+    def _release(self, ticket: Ticket) -> None:
+        with self._lock:
+            self._active -= 1
+            self._forget(ticket)
+            self._dispatch()
+
+    def _dispatch(self) -> None:
+        """ Grant free slots round robin to the waiting clients. Caller must hold the lock """
+        while self._active < self.max_concurrent and self._waiting:
+            key, queue = next(iter(self._waiting.items()))
+            ticket = queue.popleft()
+            if queue:
+                # the client has more commands waiting: put it at the end of the line
+                self._waiting.move_to_end(key)
+            else:
+                del self._waiting[key]
+            self._queued -= 1
+            self._active += 1
+            ticket.grant()
+        self._lock.notify_all()
@@ -0,0 +1,37 @@
+"""
+Per-request tracing. A sampled request records the duration of every stage of the command pipeline.
+The trace is logged as a single JSON line and, if TRACE_RESPONSE_HEADER is set, returned in the Server-Timing header.
+"""
+import json
+import logging
+
+from flask import Flask, request
+
+from executor.tracing import start_trace, finish_trace
+
+logger = logging.getLogger(__name__)
+
+
+def init_tracing(app: Flask) -> None:
+    sample_rate = app.config.get('TRACE_SAMPLE_RATE', 0.0)
+    response_header = app.config.get('TRACE_RESPONSE_HEADER', False)
+
+    @app.before_request
+    def begin_trace():
+        start_trace(request.path, sample_rate=sample_rate)
+
+    @app.after_request
+    def end_trace(response):
+        trace = finish_trace()
+        if not trace:
+            return response
+        logger.info(json.dumps(dict(
+            trace.to_dict(),
+            route=request.url_rule.rule if request.url_rule else None,
+            method=request.method,
+            status=response.status_code
+        )))
+        if response_header:
+            response.headers['Server-Timing'] = trace.server_timing()
+            response.headers['X-Trace-Id'] = trace.id
+        return response
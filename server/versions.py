@@ -0,0 +1,87 @@
+"""
+Content hashes of the challenges.
+
+Each challenge is versioned by a hash over its entry inside challenges.json and over the files inside its directory.
+The version is part of every cache key, so editing a challenge automatically invalidates its cached results,
+while the results of unchanged challenges stay valid.
+The versions are recomputed once challenges.json or any file or directory of the challenge tree was modified.
+The tree is checked at most every TREE_CHECK_INTERVAL seconds.
+"""
+import hashlib
+import json
+import os
+import typing
+from functools import lru_cache
+
+from server.lru import LRUCache
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+challenge_file = os.path.join(basedir, "../executor/docker_image/ro_volume/challenges.json")
+challenge_tree = os.path.join(basedir, "../executor/docker_image/challenges")
+
+VERSION_LENGTH = 16
+TREE_CHECK_INTERVAL = 5
+
+tree_stamp_cache = LRUCache(maxsize=1, ttl=TREE_CHECK_INTERVAL)
+
+
+def hash_directory(digest, directory: str) -> None:
+    """ Feed the relative paths, modes and contents of all files inside directory into digest """
+    for path, subdirs, files in os.walk(directory):
+        subdirs.sort()
+        for name in sorted(files):
+            filename = os.path.join(path, name)
+            digest.update(os.path.relpath(filename, directory).encode('utf-8'))
+            digest.update(oct(os.stat(filename).st_mode).encode('utf-8'))
+            with open(filename, "rb") as fd:
+                for chunk in iter(lambda: fd.read(65536), b""):
+                    digest.update(chunk)
+        for name in subdirs:
+            digest.update(os.path.relpath(os.path.join(path, name), directory).encode('utf-8') + b"/")
+
+
+def compute_version(definition: dict) -> str:
+    digest = hashlib.sha256()
+    digest.update(json.dumps(definition, sort_keys=True).encode('utf-8'))
+    directory = os.path.join(challenge_tree, definition.get('dir', definition.get('identifier', '')))
+    if os.path.isdir(directory):
+        hash_directory(digest, directory)
+    return digest.hexdigest()[:VERSION_LENGTH]
+
+
+def tree_stamp(directory: str = challenge_tree) -> typing.Tuple[int, int]:
+    """ (latest mtime, number of entries) of all files and directories inside directory """
+    latest, entries = 0, 0
+    for path, subdirs, files in os.walk(directory):
+        for name in [path] + [os.path.join(path, name) for name in files]:
+            try:
+                latest = max(latest, os.lstat(name).st_mtime_ns)
+            except OSError:
+                # removed in the meantime
+                continue
+            entries += 1
+    return latest, entries
+
+
+def cached_tree_stamp() -> typing.Tuple[int, int]:
+    stamp = tree_stamp_cache.get('stamp')
+    if stamp is None:
+        stamp = tree_stamp()
+        tree_stamp_cache.set('stamp', stamp)
+    return stamp
+
+
+@lru_cache(maxsize=1)
+def _load_versions(mtime: float, tree: typing.Tuple[int, int]) -> typing.Dict[str, str]:
+    with open(challenge_file, "r") as challenge_fd:
+        definitions: dict = json.load(challenge_fd)
+    return {identifier: compute_version(definition) for identifier, definition in definitions.items()}
+
+
+def challenge_versions() -> typing.Dict[str, str]:
+    """ Versions of all challenges. Recomputed whenever challenges.json or the challenge tree changes """
+    return _load_versions(os.stat(challenge_file).st_mtime, cached_tree_stamp())
+
+
+def challenge_version(challenge_identifier: str) -> str:
+    return challenge_versions().get(challenge_identifier, "")
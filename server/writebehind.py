@@ -0,0 +1,159 @@
+"""
+Write-behind buffer for database writes that don't need to happen while the user waits.
+
+Items are collected in a bounded in-process buffer. A background thread hands them to a flush function in batches,
+either every interval seconds or as soon as batch_size items are pending.
+A batch that could not be stored (e.g. because the database is locked) is requeued and retried
+with the next flush. It is only dropped after max_retries failed attempts in a row.
+The remaining items are flushed when the process exits.
+"""
+import atexit
+import logging
+import threading
+import typing
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehind(object):
+    """
+    flush_func:   called with a list of items inside an application context. Must commit them
+    interval:     seconds between two flushes
+    batch_size:   pending items that trigger a flush before interval has passed
+    max_pending:  if that many items are pending, put() flushes synchronously instead of growing the buffer
+    max_retries:  failed flushes in a row after which the pending items are dropped
+    """
+
+    def __init__(self, flush_func: typing.Callable[[typing.List], None], name: str = "write-behind", app=None):
+        self.flush_func = flush_func
+        self.name = name
+        self.app = None
+        self.interval: float = 0.5
+        self.batch_size: int = 100
+        self.max_pending: int = 10000
+        self.max_retries: int = 5
+        self._items: typing.List = []
+        # items that are being flushed right now
+        self._flushing: typing.List = []
+        self._lock = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: typing.Optional[threading.Thread] = None
+        self._closed = False
+        # failed flushes in a row
+        self._retries = 0
+
+        # stats
+        self._flushed = 0
+        self._batches = 0
+        self._failed = 0
+        self._requeued = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('WRITE_BEHIND_INTERVAL', self.interval)
+        self.batch_size = app.config.get('WRITE_BEHIND_BATCH_SIZE', self.batch_size)
+        self.max_pending = app.config.get('WRITE_BEHIND_MAX_PENDING', self.max_pending)
+        self.max_retries = app.config.get('WRITE_BEHIND_MAX_RETRIES', self.max_retries)
+
+    def put(self, item) -> None:
+        with self._lock:
+            self._items.append(item)
+            closed = self._closed
+            full = len(self._items) >= self.max_pending
+            if len(self._items) >= self.batch_size:
+                self._lock.notify_all()
+        if closed or full:
+            # nobody is going to flush anymore or back pressure instead of an unbounded buffer
+            self.flush()
+        else:
+            self._ensure_thread()
+
+    def pending(self) -> typing.List:
+        """ Items that were not committed yet, including the ones that are being flushed right now """
+        with self._lock:
+            return self._flushing + self._items
+
+    def flush(self) -> bool:
+        """ Flush all pending items now. Returns False if they were requeued or dropped """
+        with self._flush_lock:
+            with self._lock:
+                # taken in the same critical section, so pending() never misses them
+                items, self._items = self._items, []
+                self._flushing = items
+            if not items:
+                return True
+            return self._flush(items)
+
+    def close(self) -> bool:
+        """ Stop the background thread and flush the remaining items. Returns False if they could not be stored """
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=max(self.interval, 1) * 10)
+        for _ in range(self.max_retries + 1):
+            if self.flush():
+                return True
+        return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                pending=len(self._items),
+                flushed=self._flushed,
+                batches=self._batches,
+                failed=self._failed,
+                requeued=self._requeued,
+            )
+
+    def _ensure_thread(self) -> None:
+        # the thread is started lazily, so that forking WSGI servers do not copy it
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None or self._closed:
+                return
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                # after a failed flush, wait for the next interval instead of retrying immediately
+                if not self._closed and (len(self._items) < self.batch_size or self._retries):
+                    self._lock.wait(self.interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def _flush(self, items: typing.List) -> bool:
+        """ Must be called while holding _flush_lock, with items being _flushing """
+        try:
+            if self.app is not None:
+                with self.app.app_context():
+                    self.flush_func(items)
+            else:
+                self.flush_func(items)
+        except Exception as error:
+            with self._lock:
+                self._flushing = []
+                self._retries += 1
+                if self._retries > self.max_retries:
+                    logger.exception(f"{self.name}: dropped {len(items)} items after {self.max_retries} retries: {error}")
+                    self._retries = 0
+                    self._failed += len(items)
+                else:
+                    logger.warning(f"{self.name}: could not flush {len(items)} items (attempt {self._retries}): {error}")
+                    # keep the original order: the failed items were put before the ones that arrived meanwhile
+                    self._items[:0] = items
+                    self._requeued += len(items)
+            return False
+        with self._lock:
+            self._flushing = []
+            self._retries = 0
+            self._flushed += len(items)
+            self._batches += 1
+        return True
@@ -1,40 +1,147 @@
 """
-Loop over all challenges, run their example command and check for success.
-"""
+Verify the example solution of every challenge, e.g. before rolling out a new image.
 
+All solutions are checked in parallel (see --workers) and all failures are collected instead of stopping at the first one.
+For every challenge the time spent executing the command inside the container and the container overhead
+(everything else: borrowing a container, docker API calls, transferring the result) is reported.
+Afterwards the solutions of all challenges that modify files are run back to back inside the same container,
+to make sure that challenge directories are restored between commands.
+"""
+import argparse
+import json
 import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import json
-from server.challenges import challenge_dir
-from executor.docker_config import volume_dir
+from executor.docker_config import DockerConfig
 from executor.run_cmd import CommandExecutor
 
-
 basedir = os.path.abspath(os.path.dirname(__file__))
 volume_dir = os.path.join(basedir, "executor/docker_image/ro_volume/")
 
+
+class CheckResult(object):
+    def __init__(self, challenge_id, result, wall_time):
+        self.challenge_id = challenge_id
+        self.result = result or {}
+        self.wall_time = wall_time
+
+    @property
+    def success(self):
+        return bool(self.result.get('success'))
+
+    @property
+    def execution_time(self):
+        return self.result.get('duration', 0.0)
+
+    @property
+    def overhead(self):
+        return self.wall_time - self.execution_time
+
+
 def get_challenges():
     challenge_file = os.path.join(volume_dir, "challenges.json")
     with open(challenge_file, "rb") as challenge_file:
-        challenge_json = json.loads(challenge_file.read()) 
-    
+        challenge_json = json.loads(challenge_file.read())
+
     return challenge_json
 
 
-def check_command(command, id):
+def make_config(workers):
+    class HarnessConfig(DockerConfig):
+        POOL_SIZE = workers
+        POOL_MIN_IDLE = workers
+        POOL_MAX_IDLE = workers
+
+    return HarnessConfig()
+
+
+def check_command(runner, command, challenge_id):
+    start = time.monotonic()
     result = runner.run_command_parsed(tuple(command.split()), challenge_id)
-    success = result['success']
-    if not success:
-        raise ValueError(f"{challenge_id} FAILED. Output was", result)
-    else:
-        print(f"{challenge_id} succeeded! :-)")
+    return CheckResult(challenge_id, result, time.monotonic() - start)
 
-if __name__ == "__main__":
-    runner = CommandExecutor()
-    
-    challenges = get_challenges()
+
+def check_all(runner, challenges, workers):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(check_command, runner, challenge_definition['solution'], challenge_id)
+            for challenge_id, challenge_definition in challenges.items()
+        ]
+        return [future.result() for future in futures]
+
+
+def print_report(results):
+    print(f"{'challenge':<40} {'result':<8} {'execution (ms)':>15} {'overhead (ms)':>14} {'total (ms)':>11}")
+    for check in results:
+        print(f"{check.challenge_id:<40} {'ok' if check.success else 'FAILED':<8} "
+              f"{check.execution_time * 1000:>15.1f} {check.overhead * 1000:>14.1f} {check.wall_time * 1000:>11.1f}")
+
+
+class SingleContainerConfig(DockerConfig):
+    """ A pool with a single container, so that every command runs inside the same container """
+    POOL_SIZE = 1
+    POOL_MIN_IDLE = 1
+    POOL_MAX_IDLE = 1
+    POOL_RUNNER_DAEMON = True
+
+
+def modifies_files(challenge_definition):
+    return bool(challenge_definition.get('target_file')) or bool(challenge_definition.get('files_after_run'))
+
+
+def check_back_to_back(challenges, repetitions=2):
+    """ Every solution needs to work, no matter how often it was run before inside the same container """
+    failures = []
+    single_container_runner = CommandExecutor(config=SingleContainerConfig())
     for challenge_id, challenge_definition in challenges.items():
-        example_solution = challenge_definition['solution']
-        check_command(example_solution, challenge_id)
-    
-    print("SUCCESS")
\ No newline at end of file
+        if not modifies_files(challenge_definition):
+            continue
+        for i in range(repetitions):
+            # bypass the lru_cache, so that the command is actually executed every time
+            CommandExecutor.clear_cache()
+            result = single_container_runner.run_command_parsed(tuple(challenge_definition['solution'].split()), challenge_id)
+            if not result or not result['success']:
+                failures.append((f"{challenge_id} (run {i + 1} in the same container)", result))
+                break
+    single_container_runner.shutdown()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Number of solutions checked in parallel")
+    parser.add_argument("-c", "--challenge", action="append", help="Only check these challenges")
+    parser.add_argument("--skip-back-to-back", action="store_true", help="Skip running modifying solutions back to back")
+    args = parser.parse_args()
+
+    challenges = get_challenges()
+    if args.challenge:
+        challenges = {challenge_id: challenges[challenge_id] for challenge_id in args.challenge}
+
+    start = time.monotonic()
+    runner = CommandExecutor(config=make_config(args.workers))
+    results = check_all(runner, challenges, args.workers)
+    runner.shutdown()
+    print_report(results)
+    failures = [(check.challenge_id, check.result) for check in results if not check.success]
+
+    if not args.skip_back_to_back:
+        failures += check_back_to_back(challenges)
+    total = time.monotonic() - start
+
+    print(f"\nChecked {len(results)} challenges with {args.workers} workers in {total:.2f}s "
+          f"(execution {sum(check.execution_time for check in results):.2f}s, "
+          f"container overhead {sum(check.overhead for check in results):.2f}s)")
+    for challenge_id, result in failures:
+        print(f"{challenge_id} FAILED. Output was {result}")
+
+    if failures:
+        print(f"{len(failures)} FAILURES")
+        sys.exit(1)
+    print("SUCCESS")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Fixtures of the tests that need the flask app.
+They run against a temporary SQLite database. Commands are not executed with docker, see mock_executor.
+"""
+import json
+import os
+import tempfile
+from uuid import uuid4
+
+import pytest
+
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+db_dir = tempfile.TemporaryDirectory()
+# the database is configured when server.config is imported
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(db_dir.name, "test.db")
+
+
+@pytest.fixture(scope="session")
+def app():
+    from server.app import create_app
+
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return app
+
+
+@pytest.fixture
+def db(app):
+    """ Empty tables and empty in-process caches """
+    from server.extensions import db, c, command_cache_l1
+    from server.models import Badge
+
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        command_cache_l1.clear()
+        c.clear_cache()
+        Badge.clear_rules()
+        yield db
+        db.session.remove()
+
+
+@pytest.fixture
+def seeded(app, db):
+    """ The challenges and badges of the repository. The registries do not check for changes during a test """
+    from server.models import Badge, Challenge
+    from server.registry import challenge_registry, badge_registry
+
+    with open(os.path.join(basedir, "executor/docker_image/ro_volume/challenges.json"), "r") as challenge_fd:
+        Challenge.bulk_create(
+            dict(identifier=challenge['identifier'], name=challenge['name'], description=challenge['description'])
+            for challenge in json.loads(challenge_fd.read()).values()
+        )
+    with open(os.path.join(basedir, "data/badges.json"), "r") as badge_fd:
+        Badge.bulk_create(
+            dict(name=badge['name'], src_filename=badge['src_filename'], description=badge['description'], condition=badge.get('condition'))
+            for badge in json.loads(badge_fd.read()).values()
+        )
+    for registry in (challenge_registry, badge_registry):
+        registry.check_interval = float("inf")
+        registry.reload()
+    yield db
+    for registry in (challenge_registry, badge_registry):
+        registry.check_interval = app.config['REGISTRY_CHECK_INTERVAL']
+
+
+@pytest.fixture
+def mock_executor(monkeypatch):
+    """ Executes nothing. A command is correct if it is "solve". Returns the list of executed commands """
+    from server.extensions import c
+
+    executed = []
+
+    def run_command_parsed(command, challenge, version=None):
+        executed.append((" ".join(command), challenge))
+        return dict(success=command == ("solve",), output=" ".join(command) + "\n")
+
+    monkeypatch.setattr(c, "run_command_parsed", run_command_parsed)
+    return executed
+
+
+@pytest.fixture
+def make_user(seeded):
+    """ Creates users of the given game mode """
+    from server.crud import unit_of_work
+    from server.models import User
+
+    def make_user(mode):
+        with unit_of_work():
+            user = User.create(uuid=str(uuid4()), mode=mode)
+        return user.uuid
+
+    return make_user
@@ -0,0 +1,39 @@
+"""
+Badges that depend on the stored state of a user.
+"""
+from server.crud import unit_of_work
+from server.models import Badge, BadgeConditions, GameModes, SolvedChallenges, User, SOLVED_12_CHALLENGE
+
+
+def solved_before(uuid: str, challenge: str) -> None:
+    """ A challenge solved before the badge conditions were evaluated against it """
+    with unit_of_work():
+        user = User.query.get(uuid)
+        user.solved_challenges.append(SolvedChallenges(challenge_id=challenge))
+        user.solved_count = 1
+
+
+def badge_conditions(uuid: str) -> set:
+    return {badge.condition for badge in User.query.get(uuid).badges}
+
+
+def test_solved_12_is_awarded_on_a_later_submission(app, make_user, mock_executor):
+    uuid = make_user(GameModes.BADGE)
+    solved_before(uuid, SOLVED_12_CHALLENGE)
+
+    response = app.test_client().post("/command/run", json=dict(command="ls", challenge="01_list_all_files"), headers={"X-UUID": uuid})
+
+    assert response.status_code == 200
+    assert BadgeConditions.SOLVED_12 in badge_conditions(uuid)
+
+
+def test_backfill(make_user):
+    badge_user = make_user(GameModes.BADGE)
+    control_user = make_user(GameModes.ControlGroup)
+    for uuid in (badge_user, control_user):
+        solved_before(uuid, SOLVED_12_CHALLENGE)
+
+    assert Badge.backfill() == 1
+    assert badge_conditions(badge_user) == {BadgeConditions.SOLVED_12}
+    assert badge_conditions(control_user) == set()
+    assert Badge.backfill() == 0
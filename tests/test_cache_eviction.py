@@ -0,0 +1,43 @@
+"""
+Purging the cached commands of outdated challenge versions.
+"""
+from server.cache_eviction import stale_entries, purge_stale
+from server.models import CommandCache
+from server.queryplans import StatementRecorder
+
+VERSIONS = {"01_list_all_files": "v2", "02_get_current_directory": "v1"}
+
+
+def cache(hash_value: str, challenge: str, version):
+    return dict(hash=hash_value, challenge_identifier=challenge, challenge_version=version, cmd_output="")
+
+
+def fill_cache():
+    CommandCache.bulk_create([
+        cache("a", "01_list_all_files", "v1"),
+        cache("b", "01_list_all_files", "v1"),
+        cache("c", "01_list_all_files", "v2"),
+        cache("d", "01_list_all_files", None),
+        cache("a", "02_get_current_directory", "v1"),
+        cache("a", "removed_challenge", "v1"),
+    ])
+
+
+def test_stale_entries(db):
+    fill_cache()
+    with StatementRecorder(db.engine) as recorder:
+        assert stale_entries(VERSIONS) == {"01_list_all_files": 3, "removed_challenge": 1}
+    assert recorder.count == 1
+
+
+def test_purge_stale(db):
+    fill_cache()
+    with StatementRecorder(db.engine) as recorder:
+        assert purge_stale(VERSIONS, ["01_list_all_files", "removed_challenge"]) == 4
+    # a DELETE per challenge, none of them reads the whole table
+    assert [statement.split()[0] for statement, _ in recorder.statements] == ["DELETE", "DELETE"]
+    assert recorder.full_scans() == []
+    assert recorder.commits == 1
+    assert sorted((row.hash, row.challenge_identifier) for row in CommandCache.query) == [
+        ("a", "02_get_current_directory"), ("c", "01_list_all_files")
+    ]
@@ -0,0 +1,77 @@
+"""
+Transactions of unit_of_work and the bulk helpers of CRUDMixin.
+"""
+import pytest
+
+from server.crud import unit_of_work, in_unit_of_work
+from server.models import Challenge
+from server.queryplans import StatementRecorder
+
+
+def challenge(identifier: str, name: str = "name") -> dict:
+    return dict(identifier=identifier, name=name, description="description")
+
+
+def test_unit_of_work_commits_once(db):
+    with StatementRecorder(db.engine) as recorder:
+        with unit_of_work():
+            Challenge.create(**challenge("a"))
+            with unit_of_work():
+                Challenge.create(**challenge("b"))
+                assert in_unit_of_work()
+            # the inner block only flushed
+            assert recorder.commits == 0
+            Challenge.create(**challenge("c"))
+    assert recorder.commits == 1
+    assert not in_unit_of_work()
+    assert Challenge.query.count() == 3
+
+
+def test_unit_of_work_rolls_back(db):
+    Challenge.create(**challenge("kept"))
+    with pytest.raises(ValueError):
+        with unit_of_work():
+            Challenge.create(**challenge("a"))
+            with unit_of_work():
+                Challenge.create(**challenge("b"))
+                raise ValueError()
+    assert not in_unit_of_work()
+    assert [row.identifier for row in Challenge.query.all()] == ["kept"]
+
+
+def test_unit_of_work_inner_error_handled_by_outer_block(db):
+    with unit_of_work():
+        Challenge.create(**challenge("a"))
+        try:
+            with unit_of_work():
+                raise ValueError()
+        except ValueError:
+            pass
+        Challenge.create(**challenge("b"))
+    assert Challenge.query.count() == 2
+
+
+def test_bulk_upsert(db):
+    assert Challenge.bulk_create([challenge("a"), challenge("b")]) == 2
+    with StatementRecorder(db.engine) as recorder:
+        inserted, updated = Challenge.bulk_upsert([challenge("b", "new b"), challenge("c", "new c")])
+    assert (inserted, updated) == (1, 1)
+    assert recorder.commits == 1
+    db.session.expire_all()
+    assert {row.identifier: row.name for row in Challenge.query.all()} == {"a": "name", "b": "new b", "c": "new c"}
+
+
+def test_bulk_upsert_by_keys(db):
+    Challenge.bulk_create([challenge("a", "first")])
+    assert Challenge.bulk_upsert([dict(challenge("b", "first"), description="updated")], keys=["name"]) == (0, 1)
+    db.session.expire_all()
+    row = Challenge.query.one()
+    assert (row.identifier, row.description) == ("a", "updated")
+
+
+def test_bulk_upsert_in_unit_of_work(db):
+    with StatementRecorder(db.engine) as recorder:
+        with unit_of_work():
+            assert Challenge.bulk_upsert([challenge("a")]) == (1, 0)
+            assert Challenge.bulk_upsert([challenge("a", "new a")]) == (0, 1)
+    assert recorder.commits == 1
@@ -0,0 +1,34 @@
+"""
+Arguments of the runner containers.
+"""
+import os
+
+from executor import docker_config
+from executor.docker_config import DockerConfig, mount_source
+
+
+def test_mount_source():
+    assert mount_source("/mnt/c/terminal/executor/docker_image/ro_volume") == "/c/terminal/executor/docker_image/ro_volume"
+    assert mount_source("/home/mnt/terminal") == "/home/mnt/terminal"
+
+
+def test_host_paths_exist():
+    # the host reads the challenge files and the runner from these paths
+    assert os.path.isfile(os.path.join(docker_config.volume_dir, "challenges.json"))
+    assert os.path.isfile(os.path.join(docker_config.volume_dir, "run_cmd"))
+
+
+def test_only_the_bind_mount_is_rewritten(monkeypatch):
+    monkeypatch.setattr(docker_config, "volume_dir", "/mnt/c/terminal/ro_volume")
+    volumes = DockerConfig.runner_arguments()['volumes']
+    assert volumes["/c/terminal/ro_volume"] == {"bind": DockerConfig.RO_VOLUME, "mode": "ro"}
+
+
+def test_isolated_runners():
+    arguments = DockerConfig.isolated_runner_arguments()
+    assert arguments['read_only']
+    # every writable directory is a size capped tmpfs
+    assert set(arguments['tmpfs']) == {"/challenges", "/tmp", "/dev/shm"}
+    assert all(options.startswith("size=") for options in arguments['tmpfs'].values())
+    # the pristine challenges are part of the image, only the runner is mounted from the host
+    assert [volume['bind'] for volume in arguments['volumes'].values()] == [DockerConfig.RO_VOLUME]
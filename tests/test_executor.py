@@ -0,0 +1,69 @@
+"""
+CommandExecutor without docker: the container execution itself is replaced.
+"""
+import json
+
+import pytest
+
+from executor.run_cmd import CommandExecutor, BATCH_ARGUMENT_LIMIT
+from executor.timeout import DEFAULT_FAIL_RESPONSE, TIMEOUT_RESPONSE
+
+OUTPUT = b'{"success":false, "output":"wrong"}'
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    executor = CommandExecutor()
+    executor.clear_cache()
+    executions = []
+
+    def execute(command, challenge_name, custom_timeout=None):
+        executions.append(command)
+        return executor.outputs[command[-1]]
+
+    executor.outputs = {}
+    executor.executions = executions
+    monkeypatch.setattr(executor, "_execute_command", execute)
+    yield executor
+    executor.clear_cache()
+
+
+@pytest.mark.parametrize("output", [OUTPUT, TIMEOUT_RESPONSE])
+def test_results_are_cached(executor, output):
+    executor.outputs["ls"] = output
+    assert executor.run_command(("ls",), "01_list_all_files") == output
+    assert executor.run_command(("ls",), "01_list_all_files") == output
+
+    assert len(executor.executions) == 1
+
+
+@pytest.mark.parametrize("output", [
+    DEFAULT_FAIL_RESPONSE,
+    b'{"success": false, "output": "[Errno 2] No such file or directory", "error": true}',
+    b'not json',
+    None,
+])
+def test_internal_errors_are_not_cached(executor, output):
+    executor.outputs["pwd"] = output
+    assert executor.run_command(("pwd",), "02_get_current_directory") == output
+    assert executor.run_command(("pwd",), "02_get_current_directory") == output
+
+    assert len(executor.executions) == 2
+
+
+def test_large_batches_are_split(monkeypatch):
+    executor = CommandExecutor()
+    chunks = []
+
+    def run_batch(requests, job_timeout):
+        chunks.append(requests)
+        return [dict(success=True, output=request['command'][0]) for request in requests]
+
+    monkeypatch.setattr(executor, "_run_batch", run_batch)
+    jobs = [((f"echo {i} " + "x" * 200,), "03_echo_hello_world") for i in range(1000)]
+    results = executor.run_batch(jobs)
+
+    assert len(chunks) > 1
+    assert all(len(json.dumps(chunk).encode('utf-8')) <= BATCH_ARGUMENT_LIMIT for chunk in chunks)
+    assert [result['output'] for result in results] == [command[0] for command, _ in jobs]
+    assert chunks[0][0]['working_dir'] == "/challenges/03_echo_hello_world"
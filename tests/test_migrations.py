@@ -0,0 +1,46 @@
+"""
+Migrations of databases that were created before columns and indexes were added to the models.
+"""
+from sqlalchemy import inspect
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from server.migrations import add_column_statement, migrate
+
+
+def test_reserved_table_names_are_quoted(db):
+    users = db.metadata.tables['user']
+
+    assert add_column_statement(postgresql.dialect(), users, users.c.correct_count) == 'ALTER TABLE "user" ADD COLUMN correct_count INTEGER'
+    assert add_column_statement(mysql.dialect(), users, users.c.last_seen) == 'ALTER TABLE user ADD COLUMN last_seen DATETIME'
+    assert add_column_statement(sqlite.dialect(), users, users.c.solved_count) == 'ALTER TABLE user ADD COLUMN solved_count INTEGER'
+
+
+def test_migrate_old_user_schema(db):
+    db.drop_all()
+    # the user table before the denormalized counters were added
+    db.engine.execute(
+        'CREATE TABLE "user" (uuid VARCHAR(255) NOT NULL PRIMARY KEY, first_seen DATETIME NOT NULL, mode VARCHAR(11) NOT NULL, '
+        'age VARCHAR(255), gender VARCHAR(255), english_skills VARCHAR(255), bash_experience VARCHAR(255))'
+    )
+    db.engine.execute(
+        'CREATE TABLE submitted_command (id INTEGER NOT NULL PRIMARY KEY, command_string TEXT NOT NULL, challenge_id VARCHAR(255), '
+        'solved_challenge BOOLEAN, time_submitted DATETIME NOT NULL, user_uuid VARCHAR(255))'
+    )
+    db.engine.execute('INSERT INTO "user" (uuid, first_seen, mode) VALUES (\'u1\', \'2020-01-01 10:00:00\', \'BADGE\')')
+    for solved, time_submitted in ((1, '2020-01-01 10:01:00'), (1, '2020-01-01 10:02:00'), (0, '2020-01-01 10:03:00')):
+        db.engine.execute(
+            'INSERT INTO submitted_command (command_string, challenge_id, solved_challenge, time_submitted, user_uuid) '
+            f'VALUES (\'ls\', \'01_list_all_files\', {solved}, \'{time_submitted}\', \'u1\')'
+        )
+
+    added = migrate(db)
+
+    assert {"user.correct_count", "user.wrong_count", "user.solved_count", "user.last_seen"} <= set(added)
+    assert "ix_submitted_command_user_uuid_solved_challenge" in added
+    columns = {column['name'] for column in inspect(db.engine).get_columns("user")}
+    assert {"correct_count", "wrong_count", "solved_count", "last_seen"} <= columns
+    counters = db.engine.execute('SELECT correct_count, wrong_count, solved_count, last_seen FROM "user"').fetchone()
+    assert tuple(counters[:3]) == (2, 1, 0)
+    assert str(counters[3]).startswith("2020-01-01 10:03:00")
+    # a second run has nothing left to do
+    assert migrate(db) == []
@@ -0,0 +1,85 @@
+"""
+ContainerPool and ExecTimeout with a fake docker client.
+"""
+import os
+import subprocess
+import socket
+
+from executor.pool import ContainerPool, POOL_LABEL, OWNER_LABEL
+from executor.timeout import ExecTimeout
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen(["true"])
+    process.wait()
+    return process.pid
+
+
+class FakeContainer(object):
+    def __init__(self, labels: dict = None):
+        self.labels = labels or {}
+        self.short_id = str(id(self))[:10]
+        self.removed = False
+
+    def start(self):
+        pass
+
+    def remove(self, force=False):
+        self.removed = True
+
+
+class FakeContainers(object):
+    def __init__(self, existing=()):
+        self.existing = list(existing)
+        self.created = []
+
+    def list(self, all=False, filters=None):
+        key, value = filters['label'].split("=", 1)
+        return [container for container in self.existing if container.labels.get(key) == value]
+
+    def create(self, image, command, **arguments):
+        container = FakeContainer(arguments.get('labels'))
+        self.created.append((command, arguments))
+        return container
+
+
+class FakeClient(object):
+    def __init__(self, existing=()):
+        self.containers = FakeContainers(existing)
+
+
+def labels(owner: str, pool: str = "terminal") -> dict:
+    return {POOL_LABEL: pool, OWNER_LABEL: owner}
+
+
+def test_orphans_of_dead_processes_are_removed():
+    host = socket.gethostname()
+    orphan = FakeContainer(labels(f"{host}:{dead_pid()}"))
+    alive = FakeContainer(labels(f"{host}:{os.getppid()}"))
+    remote = FakeContainer(labels(f"another-host:{dead_pid()}"))
+    other_pool = FakeContainer(labels(f"{host}:{dead_pid()}", pool="other"))
+    pool = ContainerPool(FakeClient([orphan, alive, remote, other_pool]), "image", {}, name="terminal")
+
+    assert pool.remove_orphans() == 1
+    assert orphan.removed
+    assert not any(container.removed for container in (alive, remote, other_pool))
+    assert pool.stats()['orphans_removed'] == 1
+
+
+def test_containers_are_labelled():
+    client = FakeClient()
+    pool = ContainerPool(client, "image", {'labels': {'app': "terminal"}}, name="terminal")
+    pooled = pool._create()
+
+    _, arguments = client.containers.created[0]
+    assert arguments['labels'] == {'app': "terminal", POOL_LABEL: "terminal", OWNER_LABEL: f"{socket.gethostname()}:{os.getpid()}"}
+    assert pooled.container.labels[POOL_LABEL] == "terminal"
+
+
+def test_exec_creates_missing_working_directory(tmp_path):
+    context = ExecTimeout(pool=None, timeout=5)
+    context.working_dir = str(tmp_path / "challenges" / "02_get_current_directory")
+    context.command = ("pwd",)
+    output = subprocess.run(context.wrap_command(), stdout=subprocess.PIPE, check=True).stdout
+
+    assert output.decode().strip() == context.working_dir
@@ -0,0 +1,100 @@
+"""
+Statements, commits and query plans of the routes.
+Every route is called through the test client. The recorded statements are explained and must not scan a whole table,
+except for the small challenge and badge tables, which are loaded as a whole and cached in memory.
+"""
+import pytest
+
+from server.models import GameModes, SubmittedCommand
+from server.queryplans import StatementRecorder
+
+CHALLENGE = "01_list_all_files"
+
+
+def record(db, request):
+    with StatementRecorder(db.engine) as recorder:
+        response = request()
+    assert response.status_code < 400, response.get_data(as_text=True)
+    assert recorder.full_scans() == []
+    return recorder
+
+
+def run(client, command, uuid=None):
+    headers = {"X-UUID": uuid} if uuid else {}
+    return lambda: client.post("/command/run", json=dict(command=command, challenge=CHALLENGE), headers=headers)
+
+
+@pytest.fixture
+def client(app, seeded, mock_executor):
+    return app.test_client()
+
+
+@pytest.mark.parametrize("mode", [GameModes.ControlGroup, GameModes.PROGRESSBAR])
+def test_run_command(db, client, make_user, mode):
+    uuid = make_user(mode)
+    # cache lookup, lookup again inside the single flight, insert into the cache
+    # user, counters, submitted command, reload of the user and its badges
+    assert record(db, run(client, "ls", uuid)).count == 8
+    # the L1 cache answers
+    assert record(db, run(client, "ls", uuid)).count == 5
+
+
+def test_run_command_db_cache(db, client, make_user, mock_executor):
+    from server.extensions import command_cache_l1
+
+    uuid = make_user(GameModes.ControlGroup)
+    record(db, run(client, "ls", uuid))
+    command_cache_l1.clear()
+    assert record(db, run(client, "ls", uuid)).count == 6
+    assert len(mock_executor) == 1
+
+
+def test_run_command_anonymous(db, client):
+    assert record(db, run(client, "ls")).count == 3
+    assert record(db, run(client, "ls")).count == 0
+
+
+def test_run_command_badge(db, client, make_user):
+    uuid = make_user(GameModes.BADGE)
+    # the badge conditions add the solved challenge, the badge rules and the counters and solved challenges they check
+    recorder = record(db, run(client, "solve", uuid))
+    assert recorder.count == 20
+    assert any(statement.startswith("INSERT INTO badges_user_association_table") for statement, _ in recorder.statements)
+    assert record(db, run(client, "pwd", uuid)).count == 11
+    assert record(db, run(client, "pwd", uuid)).count == 8
+
+
+def test_user_state(db, client, make_user):
+    uuid = make_user(GameModes.BADGE)
+    assert record(db, lambda: client.get(f"/user/{uuid}/state")).count == 3
+
+
+@pytest.mark.parametrize("path", ["/challenge/list", "/badges/list"])
+def test_lists(db, client, path):
+    assert record(db, lambda: client.get(path)).count == 0
+
+
+def test_new_session(db, client):
+    form = dict(age=1, gender=1, english_skills=1, bash_experience=1)
+    assert record(db, lambda: client.post("/session/new", data=form)).count == 3
+
+
+def test_full_scans_are_detected(db):
+    with StatementRecorder(db.engine) as recorder:
+        SubmittedCommand.query.filter(SubmittedCommand.command_string == "ls").all()
+    assert [table for table, _ in recorder.full_scans()] == ["submitted_command"]
+
+
+def test_run_command_commits(db, client, make_user):
+    from server.extensions import command_cache_l1
+
+    uuid = make_user(GameModes.BADGE)
+    # the cache entry and the submission (command, counters, solved challenge and badge) are one commit each
+    recorder = record(db, run(client, "solve", uuid))
+    assert recorder.commits == 2
+    assert any(statement.startswith("INSERT INTO badges_user_association_table") for statement, _ in recorder.statements)
+    assert record(db, run(client, "solve", uuid)).commits == 1
+    command_cache_l1.clear()
+    assert record(db, run(client, "solve", uuid)).commits == 1
+    assert record(db, run(client, "ls", uuid)).commits == 2
+    assert record(db, run(client, "ls")).commits == 0
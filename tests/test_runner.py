@@ -0,0 +1,115 @@
+"""
+The runner (run_cmd), that is executed inside the containers, run against a challenge tree inside a temporary directory.
+"""
+import importlib.machinery
+import importlib.util
+import io
+import json
+import os
+import shutil
+
+import pytest
+
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+runner_path = os.path.join(basedir, "executor/docker_image/ro_volume/run_cmd")
+challenge_tree = os.path.join(basedir, "executor/docker_image/challenges")
+challenge_file = os.path.join(basedir, "executor/docker_image/ro_volume/challenges.json")
+
+# git does not track empty directories, so these challenges have no directory in the tree
+MISSING_DIRECTORY_CHALLENGES = ["02_get_current_directory", "03_echo_hello_world"]
+
+
+def load_runner():
+    loader = importlib.machinery.SourceFileLoader("run_cmd", runner_path)
+    spec = importlib.util.spec_from_loader("run_cmd", loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def runner(monkeypatch, tmp_path):
+    module = load_runner()
+    monkeypatch.setattr(module.Challenge, "CHALLENGE_FILE_PATH", challenge_file)
+    monkeypatch.setattr(module, "CHALLENGE_ROOT", str(tmp_path / "challenges"))
+    monkeypatch.setattr(module, "PRISTINE_CHALLENGE_ROOT", str(tmp_path / "ro_challenges"))
+    monkeypatch.setattr(module, "SCRATCH_DIRS", (str(tmp_path / "tmp"),))
+    module.Challenge.preload()
+    # handle_job changes the working directory
+    monkeypatch.chdir(tmp_path)
+    return module
+
+
+@pytest.fixture
+def tree(runner, tmp_path):
+    shutil.copytree(challenge_tree, str(tmp_path / "ro_challenges"), symlinks=True)
+    os.makedirs(str(tmp_path / "challenges"))
+    return runner.ChallengeTree(runner.CHALLENGE_ROOT, runner.PRISTINE_CHALLENGE_ROOT)
+
+
+def job(runner, challenge: str, command: str) -> dict:
+    return dict(challenge=challenge, command=[command], working_dir=os.path.join(runner.CHALLENGE_ROOT, challenge), timeout=5)
+
+
+def solution(challenge: str) -> str:
+    with open(challenge_file, "r") as challenge_fd:
+        return json.load(challenge_fd)[challenge]['solution']
+
+
+@pytest.mark.parametrize("challenge", MISSING_DIRECTORY_CHALLENGES)
+def test_challenge_without_directory(runner, tree, challenge):
+    tree.snapshot()
+    tree.restore()
+    result = runner.handle_job(job(runner, challenge, "pwd"), tree)
+
+    assert not result.get('error'), result['output']
+    assert result['output'].strip() == os.path.join(runner.CHALLENGE_ROOT, challenge)
+
+
+def test_solution_of_challenge_without_directory(runner, tree):
+    tree.snapshot()
+    tree.restore()
+    result = runner.handle_job(job(runner, "03_echo_hello_world", solution("03_echo_hello_world")), tree)
+
+    assert result['success']
+
+
+def test_batch_with_challenges_without_directory(runner, tree):
+    challenges = ["01_list_all_files"] + MISSING_DIRECTORY_CHALLENGES + ["09_copy_file"]
+    jobs = [job(runner, challenge, solution(challenge)) for challenge in challenges]
+    # the second run of a solution must find the directories restored
+    jobs += [job(runner, "09_copy_file", solution("09_copy_file"))]
+    output = io.StringIO()
+    runner.run_batch(jobs, output)
+    results = json.loads(output.getvalue())
+
+    assert len(results) == len(jobs)
+    for challenge, result in zip(challenges + ["09_copy_file"], results):
+        assert not result.get('error'), f"{challenge}: {result['output']}"
+    # pwd prints the temporary root instead of /challenges/..., so only the other solutions are checked
+    assert [result['success'] for result in results] == [True, False, True, True, True]
+
+
+def test_internal_errors_are_marked(runner, tree):
+    result = runner.handle_job(job(runner, "does_not_exist", "ls"), tree)
+
+    assert result['error']
+    assert not result['success']
+
+
+def test_invalid_request_is_marked(runner, tree):
+    result = runner.handle_request("{not json", tree)
+
+    assert result['error']
+
+
+def test_scratch_dirs_are_emptied_per_job(runner, tree, monkeypatch, tmp_path):
+    scratch_dirs = (str(tmp_path / "tmp"), str(tmp_path / "shm"))
+    monkeypatch.setattr(runner, "SCRATCH_DIRS", scratch_dirs)
+    for directory in scratch_dirs:
+        os.makedirs(os.path.join(directory, "left", "behind"))
+        open(os.path.join(directory, "file"), "w").close()
+    tree.snapshot()
+    runner.handle_job(job(runner, "01_list_all_files", "ls"), tree)
+
+    assert [os.listdir(directory) for directory in scratch_dirs] == [[], []]
@@ -0,0 +1,88 @@
+"""
+Latency of ContainerTimeout: the response must be ready right after the container exits,
+instead of after the next poll interval or the full timeout.
+"""
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("docker")
+
+from requests.exceptions import ReadTimeout  # noqa: E402
+
+from executor.timeout import ContainerTimeout, TIMEOUT_RESPONSE  # noqa: E402
+
+OUTPUT = b'{"success":true, "output":"hello"}'
+
+
+class FakeContainer(object):
+    """ Exits run_time seconds after wait() was called and records when that happened """
+
+    def __init__(self, run_time: float = 0.03, output: bytes = OUTPUT):
+        self.run_time = run_time
+        self.output = output
+        self.exited_at = None
+        self.stopped = False
+        self.removed = False
+        self._exited = threading.Event()
+
+    def wait(self, timeout=None):
+        if timeout is not None and self.run_time > timeout:
+            time.sleep(timeout)
+            raise ReadTimeout()
+        time.sleep(self.run_time)
+        self.exited_at = time.monotonic()
+        self._exited.set()
+        return {'StatusCode': 0}
+
+    def logs(self, stream=False):
+        assert self._exited.is_set(), "logs were read before the container exited"
+        return iter([self.output[:10], self.output[10:]])
+
+    def stop(self):
+        self.stopped = True
+
+    def remove(self):
+        self.removed = True
+
+
+def run(container: FakeContainer, timeout: float = 5) -> ContainerTimeout:
+    with ContainerTimeout(timeout=timeout) as context:
+        context.container = container
+    return context
+
+
+def test_response_is_ready_right_after_the_container_exits():
+    container = FakeContainer(run_time=0.03)
+    context = run(container)
+    responded_at = time.monotonic()
+
+    assert context.container_output == OUTPUT
+    # finish to response gap, including reading the logs and removing the container
+    assert responded_at - container.exited_at < 0.1
+
+
+def test_short_commands_do_not_wait_for_the_timeout():
+    container = FakeContainer(run_time=0.03)
+    started = time.monotonic()
+    run(container, timeout=5)
+
+    assert time.monotonic() - started < 0.5
+
+
+def test_container_is_removed():
+    container = FakeContainer()
+    run(container)
+
+    assert container.stopped and container.removed
+
+
+def test_timeout():
+    container = FakeContainer(run_time=1)
+    started = time.monotonic()
+    context = run(container, timeout=0.05)
+
+    assert context.container_output == TIMEOUT_RESPONSE
+    assert time.monotonic() - started < 0.5
+    assert container.removed
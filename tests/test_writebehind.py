@@ -0,0 +1,24 @@
+"""
+Flushing and closing of the write-behind buffer.
+"""
+from server.writebehind import WriteBehind
+
+
+def test_close_flushes_pending_items():
+    stored = []
+    buffer = WriteBehind(stored.extend)
+    buffer.put(1)
+    buffer.put(2)
+    assert buffer.close()
+    assert stored == [1, 2]
+
+
+def test_close_reports_failed_flushes():
+    def fail(items):
+        raise IOError("unable to open database file")
+
+    buffer = WriteBehind(fail)
+    buffer.max_retries = 2
+    buffer.put(1)
+    assert not buffer.close()
+    assert buffer.stats()['failed'] == 1